@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch.utils.data as data
+
+
+class DatasetWrapper(data.Dataset):
+    """Base for datasets wrapping another one. Attributes are read from and
+    written to the wrapped dataset, so code that toggles
+    loader.dataset.transform or .train keeps working."""
+
+    def __init__(self, dataset, **state):
+        self.__dict__["dataset"] = dataset
+        self.__dict__.update(state)
+
+    def __getattr__(self, name):
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.dataset, name, value)
+
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return self.dataset[idx]
+
+
+class BatchedDataset(DatasetWrapper):
+    """Lets the DataLoader (torch >= 2.0) fetch a whole batch at once:
+    __getitems__ decodes and augments the samples of a batch with a thread
+    pool (cv2 and most PIL ops release the GIL) and the default collate then
+    stacks every view inside the worker, so [img, img2], [img, img2, img3,
+    img_syn] and plain img batches arrive as they do without the wrapper."""
+
+    def __init__(self, dataset, threads=4):
+        DatasetWrapper.__init__(self, dataset, threads=threads, pool=None, pid=None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["pid"] = None
+        return state
+
+    def __getitems__(self, indices):
+        if self.pool is None or self.pid != os.getpid():
+            # one pool per DataLoader worker
+            self.__dict__["pool"] = ThreadPoolExecutor(max_workers=self.threads)
+            self.__dict__["pid"] = os.getpid()
+        return list(self.pool.map(self.dataset.__getitem__, indices))
+
+
+def batched(dataset, args=None):
+    """dataset wrapped in BatchedDataset when args.fetch_threads > 0."""
+    threads = getattr(args, "fetch_threads", 0) if args is not None else 0
+    return BatchedDataset(dataset, threads) if threads > 0 else dataset
@@ -0,0 +1,93 @@
+"""K-fold splits computed once per manifest and reused.
+
+The manifest is one of the random_list.txt / random_index.txt files the
+cross-validation datasets ship with. Without stratification fold f tests
+the f-th contiguous block of len // k entries (the split the datasets have
+always used) and trains on the remaining entries in manifest order; with
+stratification every class is cut into k contiguous blocks instead. All k
+folds are written to <manifest>.folds<k>[s]-<config>.npz, config being a
+hash of the positive prefix and the excluded names, together with a
+checksum of the manifest, and memoised per process, so building a dataset
+for any fold only reads the index arrays. With a cache directory (for a
+read-only data tree) the file is <dir>/<manifest name>-<path hash>.folds...
+instead.
+"""
+import os
+import zlib
+
+import numpy as np
+
+_folds = {}
+
+
+def split(labels, k=5, stratify=False):
+    """Test index arrays of the k folds, each sorted in manifest order."""
+    labels = np.asarray(labels)
+    if not stratify:
+        size = len(labels) // k
+        return [np.arange(f * size, (f + 1) * size) for f in range(k)]
+    tests = [[] for _ in range(k)]
+    for c in np.unique(labels):
+        for f, block in enumerate(np.array_split(np.flatnonzero(labels == c), k)):
+            tests[f].append(block)
+    return [np.sort(np.concatenate(test)) for test in tests]
+
+
+def complement(n, test):
+    mask = np.ones(n, dtype=bool)
+    mask[test] = False
+    return np.flatnonzero(mask)
+
+
+def cache_path(manifest, positive, k, stratify, exclude, cache_dir=""):
+    config = "%08x" % zlib.crc32(repr((positive, tuple(exclude))).encode())
+    prefix = manifest
+    if cache_dir:
+        prefix = os.path.join(cache_dir, "%s-%08x" % (os.path.basename(manifest),
+                                                      zlib.crc32(os.path.abspath(manifest).encode())))
+    return "%s.folds%d%s-%s.npz" % (prefix, k, "s" if stratify else "", config)
+
+
+def load_folds(manifest, positive, k=5, stratify=False, exclude=(), cache_dir=""):
+    """Entries, labels (1 when the file name starts with positive) and the
+    k test index arrays of a manifest, from the process memo, the npz next
+    to the manifest (or in cache_dir), or computed and saved there."""
+    key = (os.path.abspath(manifest), positive, k, stratify, tuple(exclude))
+    if key in _folds:
+        return _folds[key]
+
+    with open(manifest, "rb") as f:
+        content = f.read()
+    checksum = zlib.crc32(content + repr(key[1:]).encode())
+    cache = cache_path(manifest, positive, k, stratify, exclude, cache_dir)
+
+    folds = None
+    if os.path.exists(cache):
+        saved = np.load(cache)
+        if int(saved["checksum"]) == checksum:
+            folds = (list(saved["items"]), saved["labels"], [saved["test%d" % f] for f in range(k)])
+
+    if folds is None:
+        items = [item for item in content.decode().split() if item.split("/")[-1] not in exclude]
+        labels = np.array([1 if item.split("/")[-1][0] == positive else 0 for item in items], dtype=np.int64)
+        tests = split(labels, k, stratify)
+        folds = (items, labels, tests)
+        try:
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            np.savez(cache, checksum=checksum, items=np.array(items), labels=labels,
+                     **dict(("test%d" % f, test) for f, test in enumerate(tests)))
+        except OSError:
+            print("could not write fold cache", cache)
+
+    _folds[key] = folds
+    return folds
+
+
+def get_fold(manifest, fold, positive, k=5, stratify=False, exclude=(), cache_dir=""):
+    """(train_items, train_labels, test_items, test_labels) of one fold."""
+    items, labels, tests = load_folds(manifest, positive, k, stratify, exclude, cache_dir)
+    test = tests[fold]
+    train = complement(len(items), test)
+    return ([items[i] for i in train], labels[train].tolist(),
+            [items[i] for i in test], labels[test].tolist())
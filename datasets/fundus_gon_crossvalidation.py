@@ -8,6 +8,8 @@ import torch.utils.data as data
 import numpy as np
 from skimage.transform import resize
 from PIL import Image
+from datasets.folds import get_fold
+from datasets.image_loader import as_input, load_images
 
 
 class traindataset(data.Dataset):
@@ -25,67 +27,44 @@ class traindataset(data.Dataset):
         self.transform = transform
         self.name = []
         self.train = train
+        self.numpy_input = getattr(args, "aug_backend", "pil") == "cv2"
         self.multitask = args.multitask
         self.multiaug = args.multiaug
         self.synthesis = args.synthesis
 
 
-        images_path = np.genfromtxt(self.root_dir + '/iChanllenge-Gon/Training400/random_index.txt', dtype='str')
-        images_path = list(images_path)
-        images_path = [self.root_dir + "/iChanllenge-Gon/Training400/" + item for item in images_path]
-
-        num_fold = int(len(images_path) / 5)
-        if args.seed == 0:
-            test_path = images_path[:num_fold]
-        elif args.seed == 1:
-            test_path = images_path[num_fold:2*num_fold]
-        elif args.seed == 2:
-            test_path = images_path[2 * num_fold:3 * num_fold]
-        elif args.seed == 3:
-            test_path = images_path[3 * num_fold:4 * num_fold]
-        elif args.seed == 4:
-            test_path = images_path[4 * num_fold:5 * num_fold]
-
-        train_path = list(set(images_path) - set(test_path))
-
-        label_list_train = [1 if item.split("/")[-1][0] == "g" else 0 for item in train_path]
-        label_list_test = [1 if item.split("/")[-1][0] == "g" else 0 for item in test_path]
+        # in each fold, train and test path are fixed.
+        train_path, label_list_train, test_path, label_list_test = get_fold(
+            self.root_dir + '/iChanllenge-Gon/Training400/random_index.txt', args.seed, "g", stratify=getattr(args, "stratify", False),
+            cache_dir=getattr(args, "fold_cache", ""))
 
         print ("train p: ", sum(label_list_train), len(label_list_train)-sum(label_list_train))
         print ("test p: ", sum(label_list_test), len(label_list_test) - sum(label_list_test))
 
         if self.train:
-            self.train_dataset = []
-            self.targets = []
-            self.rotation_label = []
             self.train_synthesis = []
-            for i in range(0, len(train_path)):
-                image = cv2.imread(self.root_dir + "/iChanllenge-Gon/Training400/resized_images_320/" + train_path[i].split("/")[-1])
-
-                self.train_dataset.append(image)
-                self.targets.append(label_list_train[i])
-                self.name.append(train_path[i].split("/")[-1])
-                self.rotation_label.append(0)
-                if self.synthesis:
-                    print ("load syn data")
-                    image = cv2.imread(self.root_dir + "/iChanllenge-Gon/Training400/resized_image_syn_early/" + train_path[i].split("/")[-1][:-4] + ".png")
-                    self.train_dataset.append(image)
-                    self.name.append(train_path[i].split("/")[-1])
-                    self.targets.append(label_list_train[i])
+            names = [item.split("/")[-1] for item in train_path]
+            self.train_dataset = load_images([self.root_dir + "/iChanllenge-Gon/Training400/resized_images_320/" + item for item in names], args, "GON train")
+            self.targets = list(label_list_train)
+            self.name = list(names)
+            self.rotation_label = [0] * len(names)
+            if self.synthesis:
+                # each synthetic image follows its original
+                syn = load_images([self.root_dir + "/iChanllenge-Gon/Training400/resized_image_syn_early/" + item[:-4] + ".png" for item in names], args, "GON syn")
+                self.train_dataset = [image for pair in zip(self.train_dataset, syn) for image in pair]
+                self.name = [item for item in names for _ in range(2)]
+                self.targets = [item for item in label_list_train for _ in range(2)]
 
             print("Train images Gon ", len(self.train_dataset), "P: ", sum(self.targets), "N: ", len(self.targets) - sum(self.targets))
 
         else:
-            self.train_dataset = []
-            self.targets = []
-            for i in range(0, len(test_path)):
-                image = cv2.imread(self.root_dir + "/iChanllenge-Gon/Training400/resized_images_320/" + test_path[i].split("/")[-1])
-                # image = cv2.imread(
-                #     self.root_dir + "/iChanllenge-Gon/Training400/resized_image_syn_early/" + test_path[i].split("/")[
-                #                                                                                   -1][:-4] + ".png")
-                self.train_dataset.append(image)
-                self.targets.append(label_list_test[i])
-                self.name.append(test_path[i].split("/")[-1])
+            names = [item.split("/")[-1] for item in test_path]
+            # image = cv2.imread(
+            #     self.root_dir + "/iChanllenge-Gon/Training400/resized_image_syn_early/" + test_path[i].split("/")[
+            #                                                                                   -1][:-4] + ".png")
+            self.train_dataset = load_images([self.root_dir + "/iChanllenge-Gon/Training400/resized_images_320/" + item for item in names], args, "GON test")
+            self.targets = list(label_list_test)
+            self.name = list(names)
             print("Test images Gon ", len(self.train_dataset), "P: ", sum(self.targets), "N: ", len(self.targets) - sum(self.targets))
             print ("name", self.name)
 
@@ -97,7 +76,7 @@ class traindataset(data.Dataset):
 
         sample = self.train_dataset[idx]
 
-        sample = Image.fromarray(np.uint8(sample))
+        sample = as_input(sample, self.numpy_input)
 
         img = self.transform(sample)
         target = self.targets[idx]
@@ -106,7 +85,7 @@ class traindataset(data.Dataset):
             num_int = np.random.randint(0, 2)
             if self.synthesis and num_int == 0:
                 img2 = self.train_synthesis[idx]
-                img2 = Image.fromarray(np.uint8(img2))
+                img2 = as_input(img2, self.numpy_input)
                 img2 = self.transform(img2)
             else:
                 img2 = self.transform(sample)
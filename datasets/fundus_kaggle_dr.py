@@ -1,5 +1,7 @@
 import cv2
+import os
 import sys
+import time
 if sys.version_info[0] == 2:
     import cPickle as pickle
 else:
@@ -8,6 +10,18 @@ import torch.utils.data as data
 import numpy as np
 from PIL import Image
 import glob
+from datasets.image_loader import as_input, num_threads
+from datasets.manifest import load_index, select
+from datasets.lmdb_store import LMDBStore, resize_shorter
+from datasets.image_cache import ImageCache
+
+
+def dr_roots(root, args=None):
+    """(train root, test root) of Kaggle DR: --dr-root (default
+    <root>/kaggle_dr) and --dr-test-root (default the train root)."""
+    dr_root = getattr(args, "dr_root", "") or root + "/kaggle_dr"
+    return dr_root, getattr(args, "dr_test_root", "") or dr_root
+
 
 class traindataset(data.Dataset):
     """Face Landmarks dataset."""
@@ -24,16 +38,45 @@ class traindataset(data.Dataset):
         self.transform = transform
         self.name = []
         self.train = train
+        self.numpy_input = getattr(args, "aug_backend", "pil") == "cv2"
         self.multitask = args.multitask
         self.multiaug = args.multiaug
         self.test_type = test_type
 
         self.synthesis = args.synthesis
         self.train_syn  = []
+        self.lmdb = None
+        # inode of every train image, for lib.samplers.LocalitySampler (None with --lmdb)
+        self.inode = None
+        # decoded images, shorter side downscaled to cache_size, kept per DataLoader worker
+        self.cache_mb = getattr(args, "dr_cache_mb", 0) if self.train else 0
+        self.cache_size = getattr(args, "dr_cache_size", 512)
+        self.cache = None
+        self.cache_pid = None
+        self.cache_stats = None
+        self.decode_s = 0.
+
+        dr_root, dr_test_root = dr_roots(self.root_dir, args)
+        order = getattr(args, "dr_order", "list")
 
         if self.train:
-            train_path = list(np.genfromtxt(self.root_dir + "/kaggle_dr/data_list.txt", dtype='str'))
-            self.train_dataset = [self.root_dir + "/kaggle_dr/"+ item for item in train_path]
+            train_path = list(np.genfromtxt(dr_root + "/data_list.txt", dtype='str'))
+            if getattr(args, "lmdb", ""):
+                # pre-resized images from datasets/lmdb_store.py, keyed by position in data_list.txt
+                self.lmdb = LMDBStore(args.lmdb)
+                if list(self.lmdb.names) != train_path:
+                    raise ValueError("lmdb store %s was not written from %s/data_list.txt (rerun datasets/lmdb_store.py --dr-root %s)"
+                                     % (args.lmdb, dr_root, dr_root))
+                self.lmdb_keys = self.lmdb.available()
+                train_path = [train_path[i] for i in self.lmdb_keys]
+                print("reading train images from", args.lmdb)
+            else:
+                index = load_index(dr_root + "/data_list.txt", [dr_root + "/" + item for item in train_path], [0] * len(train_path), num_threads(args))
+                # training is shuffled, so the on-disk order is applied by the sampler (kaggle_main.py)
+                keep = select(index)
+                train_path = [train_path[i] for i in keep]
+                self.inode = index["inode"][keep]
+            self.train_dataset = [dr_root + "/" + item for item in train_path]
             self.targets        = [0] * len(train_path) # did not load labels for training data.
             self.rotation_label = [0] * len(train_path)
             self.name = train_path
@@ -65,11 +108,12 @@ class traindataset(data.Dataset):
             self.train_dataset = []
             self.targets =[]
             self.name = []
-            test_path = list(np.genfromtxt("/raid/li/datasets/kaggle_dr/test_id.txt", dtype="str"))
-            test_label = np.loadtxt("/raid/li/datasets/kaggle_dr/test_label.txt", dtype='uint8')
-            for i in range(0, len(test_path)):
-                # image = cv2.imread("/raid/li/datasets/kaggle_dr/resized_test/" + test_path[i] + ".jpeg")
-                self.train_dataset.append("/raid/li/datasets/kaggle_dr/resized_test/" + test_path[i] + ".jpeg")
+            test_path = list(np.genfromtxt(dr_test_root + "/test_id.txt", dtype="str"))
+            test_label = np.loadtxt(dr_test_root + "/test_label.txt", dtype='uint8')
+            index = load_index(dr_test_root + "/test_id.txt", [dr_test_root + "/resized_test/" + item + ".jpeg" for item in test_path], test_label, num_threads(args))
+            for i in select(index, order):
+                # image = cv2.imread(dr_test_root + "/resized_test/" + test_path[i] + ".jpeg")
+                self.train_dataset.append(dr_test_root + "/resized_test/" + test_path[i] + ".jpeg")
                 self.targets.append(test_label[i])
                 self.name.append(test_path[i])
             print("Test images DR ", len(self.train_dataset), "0: ", sum([item == 0 for item in self.targets]), "1: ",
@@ -83,14 +127,38 @@ class traindataset(data.Dataset):
 
     def __getitem__(self, idx):
 
-        sample = self.train_dataset[idx]
-
-        sample = cv2.imread(sample)
-
-        sample = Image.fromarray(np.uint8(sample))
+        sample = self.cached(idx) if self.cache_mb > 0 else self.load(idx)
+
+        return self.sample(sample, self.targets[idx], idx, self.name[idx], self.rotation_label[idx] if self.train else 0)
+
+    def load(self, idx):
+        if self.lmdb is not None:
+            return self.lmdb.get(self.lmdb_keys[idx])
+        return cv2.imread(self.train_dataset[idx])
+
+    def cached(self, idx):
+        if self.cache is None or self.cache_pid != os.getpid():
+            # one cache per DataLoader worker
+            self.cache = ImageCache(int(self.cache_mb * 2 ** 20))
+            self.cache_pid = os.getpid()
+            self.decode_s = 0.
+        image = self.cache.get(idx)
+        if image is None:
+            start = time.time()
+            image = self.load(idx)
+            if image is not None:
+                image = self.cache.put(idx, resize_shorter(image, self.cache_size))
+            self.decode_s += time.time() - start
+        if self.cache_stats is not None:
+            self.cache_stats.update(self.cache, self.decode_s)
+        return image
+
+    def sample(self, sample, target, idx, name, rotation_label=0):
+        """The training tuple of a decoded BGR image; also used by
+        datasets/tar_shards.py."""
+        sample = as_input(sample, self.numpy_input)
 
         img = self.transform(sample)
-        target = self.targets[idx]
 
         if self.train and self.multiaug:
 
@@ -98,20 +166,19 @@ class traindataset(data.Dataset):
 
             # sample_syn = self.train_syn[idx]
             # sample_syn = cv2.imread(sample_syn)
-            # sample_syn = Image.fromarray(np.uint8(sample_syn))
+            # sample_syn = as_input(sample_syn, self.numpy_input)
             # img_syn = self.transform(sample_syn)
             # img_syn2 = self.transform(sample_syn)
 
             # img3 = self.transform(sample)
-            # return [img, img2, img3, img_syn], [target], idx, self.name[idx]
+            # return [img, img2, img3, img_syn], [target], idx, name
             #
             if self.multitask:
-                rotation_label = self.rotation_label[idx]
-                return [img, img2], [target, rotation_label], idx, self.name[idx]
+                return [img, img2], [target, rotation_label], idx, name
             else:
-                return [img, img2], target, idx, self.name[idx]
+                return [img, img2], target, idx, name
 
-        return img, target, idx, self.name[idx]
+        return img, target, idx, name
 
 if __name__ == '__main__':
     count = 0
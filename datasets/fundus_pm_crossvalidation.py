@@ -8,6 +8,8 @@ import torch.utils.data as data
 import numpy as np
 from skimage.transform import resize
 from PIL import Image
+from datasets.folds import get_fold
+from datasets.image_loader import as_input, load_images
 
 class traindataset(data.Dataset):
     """Face Landmarks dataset."""
@@ -24,50 +26,28 @@ class traindataset(data.Dataset):
         self.transform = transform
         self.name = []
         self.train = train
+        self.numpy_input = getattr(args, "aug_backend", "pil") == "cv2"
         self.multiaug = args.multiaug
         self.multitask = args.multitask
 
 
-        images_path = np.genfromtxt( self.root_dir + '/PAML/random_list.txt', dtype='str')
-        images_path = list(images_path)
-        images_path = [self.root_dir + item for item in images_path]
-
-        num_fold = int(len(images_path) / 5)
-        if args.seed == 0:
-            test_path = images_path[:num_fold]
-        elif args.seed == 1:
-            test_path = images_path[num_fold:2*num_fold]
-        elif args.seed == 2:
-            test_path = images_path[2 * num_fold:3 * num_fold]
-        elif args.seed == 3:
-            test_path = images_path[3 * num_fold:4 * num_fold]
-        elif args.seed == 4:
-            test_path = images_path[4 * num_fold:5 * num_fold]
-
-        train_path = list(set(images_path) - set(test_path))
-
-        label_list_train = [1 if item.split("/")[-1][0] == "P" else 0 for item in train_path]
-        label_list_test = [1 if item.split("/")[-1][0] == "P" else 0 for item in test_path]
+        # in each fold, train and test path are fixed.
+        train_path, label_list_train, test_path, label_list_test = get_fold(
+            self.root_dir + '/PAML/random_list.txt', args.seed, "P", stratify=getattr(args, "stratify", False),
+            cache_dir=getattr(args, "fold_cache", ""))
 
         if self.train:
-            self.train_dataset = []
-            self.targets = []
-            self.rotation_label = []
-            for i in range(0, len(train_path)):
-                image = cv2.imread(args.data + "/PAML/resized_image_320/" + train_path[i].split("/")[-1])
-                self.train_dataset.append(image)
-                self.targets.append(label_list_train[i])
-                self.name.append(train_path[i].split("/")[-1])
-                self.rotation_label.append(0)
+            names = [item.split("/")[-1] for item in train_path]
+            self.train_dataset = load_images([args.data + "/PAML/resized_image_320/" + item for item in names], args, "PM train")
+            self.targets = list(label_list_train)
+            self.name = list(names)
+            self.rotation_label = [0] * len(names)
             print("Train images PM ", len(self.train_dataset), "P: ", sum(self.targets), "Neg: ", len(self.targets) - sum(self.targets))
         else:
-            self.train_dataset = []
-            self.targets = []
-            for i in range(0, len(test_path)):
-                image = cv2.imread(args.data + "/PAML/resized_image_320/" + test_path[i].split("/")[-1])
-                self.train_dataset.append(image)
-                self.targets.append(label_list_test[i])
-                self.name.append(test_path[i].split("/")[-1])
+            names = [item.split("/")[-1] for item in test_path]
+            self.train_dataset = load_images([args.data + "/PAML/resized_image_320/" + item for item in names], args, "PM test")
+            self.targets = list(label_list_test)
+            self.name = list(names)
             print("Test images PM ", len(self.train_dataset), "P: ", sum(self.targets), "Neg: ", len(self.targets) - sum(self.targets))
 
     def __len__(self):
@@ -77,7 +57,7 @@ class traindataset(data.Dataset):
 
         sample = self.train_dataset[idx]
 
-        sample = Image.fromarray(np.uint8(sample))
+        sample = as_input(sample, self.numpy_input)
 
         img = self.transform(sample)
         target = self.targets[idx]
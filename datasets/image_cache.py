@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+import torch
+from torch.utils.data import get_worker_info
+
+
+class ImageCache(object):
+    """Decoded images keyed by path, least recently used evicted first once
+    the total size exceeds budget bytes. Cached arrays are made read-only
+    because every dataset that asks for the path shares them; callers that
+    modify an image must copy it (datasets.image_loader.as_input does)."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self.images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        if image is None or image.nbytes > self.budget:
+            return image
+        image.setflags(write=False)
+        with self.lock:
+            if key in self.images:
+                self.nbytes -= self.images.pop(key).nbytes
+            self.images[key] = image
+            self.nbytes += image.nbytes
+            while self.nbytes > self.budget:
+                _, old = self.images.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / float(total) if total else 0.,
+                "images": len(self.images), "mb": self.nbytes / 2. ** 20}
+
+
+class WorkerCacheStats(object):
+    """Counters of the per-worker caches (hits, misses, decode seconds,
+    cached MB per worker) in a shared-memory tensor, created before the
+    DataLoader starts its workers so the main process can read them.
+    summary() also reports the hit rate and decode time since its last call."""
+
+    FIELDS = ("hits", "misses", "decode_s", "mb")
+
+    def __init__(self, workers):
+        self.counters = torch.zeros(max(1, workers), len(self.FIELDS), dtype=torch.float64).share_memory_()
+        self.last = [0., 0., 0.]
+
+    def update(self, cache, decode_s):
+        worker = get_worker_info()
+        row = self.counters[worker.id if worker is not None else 0]
+        row[0], row[1], row[2], row[3] = cache.hits, cache.misses, decode_s, cache.nbytes / 2. ** 20
+
+    def summary(self):
+        hits, misses, decode_s, mb = self.counters.sum(0).tolist()
+        new_hits, new_misses, new_decode_s = hits - self.last[0], misses - self.last[1], decode_s - self.last[2]
+        self.last = [hits, misses, decode_s]
+        total, new_total = hits + misses, new_hits + new_misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.,
+                "decode_s": decode_s, "mb": mb,
+                "recent_hit_rate": new_hits / new_total if new_total else 0., "recent_decode_s": new_decode_s}
+
+
+_cache = None
+
+
+def shared_cache(args=None):
+    """The process-wide cache, sized by args.image_cache_mb on first use
+    (None when the budget is 0)."""
+    global _cache
+    budget_mb = getattr(args, "image_cache_mb", 0) if args is not None else 0
+    if budget_mb <= 0:
+        return None
+    if _cache is None:
+        _cache = ImageCache(int(budget_mb * 2 ** 20))
+    return _cache
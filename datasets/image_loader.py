@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from datasets.image_cache import shared_cache
+from datasets.manifest import check_paths
+
+
+def num_threads(args=None):
+    threads = getattr(args, "load_threads", 0) if args is not None else 0
+    if threads <= 0:
+        threads = min(16, os.cpu_count() or 1)
+    return threads
+
+
+def load_images(paths, args=None, desc="images"):
+    """cv2.imread every path with a bounded thread pool (cv2 releases the GIL
+    while decoding). Results keep the order of paths.
+    With args.packed set, images found in that packed store are returned as
+    read-only views of its memory map instead of being decoded; otherwise
+    the process-wide cache (args.image_cache_mb) is consulted first, so
+    fold loops and repeated train/val construction decode each path once.
+    Images from the packed store or the cache are shared and read-only;
+    as_input hands transforms a writable copy of them.
+    Directories with a manifest.csv must list every requested image."""
+    check_paths(paths)
+    start = time.time()
+    total = len(paths)
+    images = [None] * total
+    todo = list(range(total))
+
+    packed = getattr(args, "packed", "") if args is not None else ""
+    if packed:
+        from datasets.packed_store import open_store, relative_key
+        store = open_store(packed)
+        keys = [relative_key(path, args.data) for path in paths]
+        todo = []
+        for i, key in enumerate(keys):
+            if key in store:
+                images[i] = store.get(key)
+            else:
+                todo.append(i)
+        if not todo:
+            print("loaded %d %s from %s in %.2fs" % (total, desc, packed, time.time() - start))
+            return images
+
+    cache = shared_cache(args)
+    cached = 0
+    if cache is not None:
+        remaining = []
+        for i in todo:
+            images[i] = cache.get(paths[i])
+            if images[i] is None:
+                remaining.append(i)
+        cached = len(todo) - len(remaining)
+        todo = remaining
+
+    threads = num_threads(args)
+    step = max(100, len(todo) // 4)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for n, (i, image) in enumerate(zip(todo, pool.map(cv2.imread, [paths[i] for i in todo]))):
+            images[i] = image if cache is None else cache.put(paths[i], image)
+            if (n + 1) % step == 0 and n + 1 < len(todo):
+                print("  loading %s: %d/%d" % (desc, n + 1, len(todo)))
+
+    missing = sum(images[i] is None for i in todo)
+    print("loaded %d %s in %.2fs with %d threads%s%s%s" % (total, desc, time.time() - start, threads,
+                                                          ", %d from %s" % (total - len(todo) - cached, packed) if packed else "",
+                                                          ", %d cached" % cached if cache is not None else "",
+                                                          ", %d missing" % missing if missing else ""))
+    return images
+
+
+def as_input(image, numpy_input=False):
+    """A decoded image as the transform expects it: the BGR uint8 array for
+    the cv2 backend (lib/cv_transforms.py), copied when it is a read-only
+    shared one, a PIL image otherwise."""
+    if numpy_input:
+        return image if image.flags.writeable else image.copy()
+    return Image.fromarray(np.uint8(image))
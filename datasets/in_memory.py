@@ -0,0 +1,74 @@
+import math
+
+import cv2
+import numpy as np
+import torch
+
+
+def stack_images(images, device):
+    """Decoded BGR images as one uint8 RGB tensor N x 3 x H x W; images of
+    another size are resized to the first one's."""
+    height, width = images[0].shape[:2]
+    array = np.empty((len(images), 3, height, width), dtype=np.uint8)
+    for i, image in enumerate(images):
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        array[i] = image[:, :, ::-1].transpose(2, 0, 1)
+    return torch.from_numpy(array).to(device)
+
+
+def synthesis_images(dataset):
+    """The synthesised training images of a cross-validation dataset (AMD
+    and PM store them in train_syn, GON in train_synthesis)."""
+    images = getattr(dataset, "train_syn", None) or getattr(dataset, "train_synthesis", None)
+    if not images:
+        raise ValueError("%s has no synthesised training images" % type(dataset).__module__)
+    return images
+
+
+class InMemoryLoader(object):
+    """Iterates a cross-validation training set kept as one uint8 tensor and
+    augments every batch with a BatchAugment in the main process. Batches
+    have the layout the dataset's __getitem__ produces through a DataLoader
+    (views, targets, index, names) for the synthesis, multitask, multiaug
+    and plain modes, with the views already on the device."""
+
+    def __init__(self, dataset, augment, batch_size, shuffle=False, drop_last=False, device="cuda"):
+        self.augment = augment
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.synthesis = dataset.synthesis
+        self.multitask = dataset.multitask
+        self.multiaug = dataset.multiaug
+
+        self.images = stack_images(dataset.train_dataset, device)
+        self.syn = stack_images(synthesis_images(dataset), device) if self.synthesis else None
+        self.targets = torch.LongTensor(dataset.targets)
+        self.names = list(dataset.name)
+        print("in-memory train set %s, %.1f MB on %s" % (tuple(self.images.shape),
+              self.images.numel() * (2 if self.synthesis else 1) / 2. ** 20, device))
+
+    def __len__(self):
+        n = self.images.size(0)
+        return n // self.batch_size if self.drop_last else int(math.ceil(n / float(self.batch_size)))
+
+    def __iter__(self):
+        n = self.images.size(0)
+        order = torch.randperm(n) if self.shuffle else torch.arange(n)
+        for b in range(len(self)):
+            index = order[b * self.batch_size:(b + 1) * self.batch_size]
+            images = self.images[index.to(self.images.device)]
+            target = self.targets[index]
+            names = [self.names[i] for i in index.tolist()]
+
+            if self.synthesis:
+                views = [self.augment(images) for _ in range(3)]
+                views.append(self.augment(self.syn[index.to(self.syn.device)]))
+                yield views, [target], index, names
+            elif self.multitask:
+                yield [self.augment(images), self.augment(images)], [target, torch.zeros_like(target)], index, names
+            elif self.multiaug:
+                yield [self.augment(images), self.augment(images)], [target], index, names
+            else:
+                yield self.augment(images), target, index, names
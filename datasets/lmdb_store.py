@@ -0,0 +1,197 @@
+"""Kaggle DR training images in LMDB shards.
+
+Sample i of <dr root>/data_list.txt (--dr-root, default <data>/kaggle_dr,
+as in kaggle_main.py) lives in shard i % num_shards under the key
+b"%08d" % i, either re-encoded as JPEG or as raw uint8 (--raw) after
+resizing the shorter side to --size. Every shard also stores __meta__
+(count, shards, format, and the indices of images that could not be read,
+which have no key) and shard 0 the list of names. Readers open the
+environments readonly and lock-free on first access in each process and
+share them through a module-level table, so several stores on one path can
+coexist and forked DataLoader workers each get their own handles.
+
+    python -m datasets.lmdb_store ./data --out ./data/kaggle_dr/lmdb --shards 8 --size 512
+    python -m datasets.lmdb_store ./data --out ./data/kaggle_dr/lmdb --bench 2000
+    python kaggle_main.py ./data ... --lmdb ./data/kaggle_dr/lmdb
+"""
+import argparse
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+_envs = {}
+
+
+def shard_path(path, shard):
+    return os.path.join(path, "shard-%03d" % shard)
+
+
+def open_env(path):
+    """The readonly environment at path for this process (lmdb refuses a
+    second one per path and process)."""
+    import lmdb
+    path = os.path.abspath(path)
+    pid, env = _envs.get(path, (None, None))
+    if pid != os.getpid():
+        if env is not None:
+            # handles inherited through fork must not be used in the child
+            env.close()
+        env = lmdb.open(path, readonly=True, lock=False, readahead=False, meminit=False, max_readers=512)
+        _envs[path] = (os.getpid(), env)
+    return env
+
+
+def resize_shorter(image, size):
+    h, w = image.shape[:2]
+    if size <= 0 or min(h, w) <= size:
+        return image
+    scale = size / float(min(h, w))
+    return cv2.resize(image, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def encode(image, raw, quality):
+    if raw:
+        return pickle.dumps((image.shape, image.tobytes()), protocol=pickle.HIGHEST_PROTOCOL)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def convert(list_file, image_root, out, num_shards=8, size=512, raw=False, quality=95, threads=8, map_size=2 ** 40, chunk=512):
+    """Store the images named in list_file (relative to image_root)."""
+    import lmdb
+
+    names = list(np.genfromtxt(list_file, dtype='str'))
+    paths = [image_root + "/" + item for item in names]
+    os.makedirs(out, exist_ok=True)
+    envs = [lmdb.open(shard_path(out, s), map_size=map_size, subdir=True, meminit=False, map_async=True)
+            for s in range(num_shards)]
+
+    def load(path):
+        image = cv2.imread(path)
+        return None if image is None else encode(resize_shorter(image, size), raw, quality)
+
+    start = time.time()
+    missing = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for begin in range(0, len(paths), chunk):
+            values = list(pool.map(load, paths[begin:begin + chunk]))
+            txns = [env.begin(write=True) for env in envs]
+            for i, value in enumerate(values, begin):
+                if value is None:
+                    missing.append(i)
+                    continue
+                txns[i % num_shards].put(b"%08d" % i, value)
+            for txn in txns:
+                txn.commit()
+            print("  %d/%d (%.1fs)" % (min(begin + chunk, len(paths)), len(paths), time.time() - start))
+
+    meta = pickle.dumps({"count": len(names), "shards": num_shards, "format": "raw" if raw else "jpg", "missing": missing})
+    for s, env in enumerate(envs):
+        with env.begin(write=True) as txn:
+            txn.put(b"__meta__", meta)
+            if s == 0:
+                txn.put(b"__names__", pickle.dumps(names))
+        env.sync()
+        env.close()
+    print("wrote %d images into %d shards at %s in %.1fs" % (len(names) - len(missing), num_shards, out, time.time() - start))
+    if missing:
+        print("missing or unreadable (recorded in __meta__, left out by readers):", [names[i] for i in missing])
+
+
+class LMDBStore(object):
+    """Reader of a store written by convert. names are the list it was
+    written from, missing the positions in it that have no image;
+    available() the others."""
+
+    def __init__(self, path):
+        self.path = path
+        with open_env(shard_path(path, 0)).begin() as txn:
+            meta = pickle.loads(txn.get(b"__meta__"))
+            self.names = pickle.loads(txn.get(b"__names__"))
+        self.count = meta["count"]
+        self.num_shards = meta["shards"]
+        self.raw = meta["format"] == "raw"
+        # stores written before missing images were recorded
+        self.missing = frozenset(meta.get("missing", ()))
+        if self.missing:
+            print("lmdb store %s: %d images missing at conversion are left out" % (path, len(self.missing)))
+
+    def available(self):
+        """Positions in names that have an image."""
+        return [i for i in range(self.count) if i not in self.missing]
+
+    def __len__(self):
+        return self.count
+
+    def get_bytes(self, idx):
+        with open_env(shard_path(self.path, idx % self.num_shards)).begin(buffers=True) as txn:
+            value = txn.get(b"%08d" % idx)
+            if value is None:
+                raise KeyError("sample %d (%s) is not in the lmdb store %s" % (idx, self.names[idx], self.path))
+            return bytes(value)
+
+    def get(self, idx):
+        value = self.get_bytes(idx)
+        if self.raw:
+            shape, data = pickle.loads(value)
+            return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+        return cv2.imdecode(np.frombuffer(value, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def benchmark(image_root, path, n=2000, workers=4, batch_size=64):
+    """Samples per second of the folder reader (cv2.imread per file) and the
+    LMDB reader, decoding only, through a DataLoader with `workers`."""
+    import torch.utils.data as data
+
+    store = LMDBStore(path)
+    names = store.names
+    available = store.available()
+    order = np.array(available)[np.random.RandomState(0).permutation(len(available))[:n]]
+
+    class Reader(data.Dataset):
+        def __init__(self, fn):
+            self.fn = fn
+
+        def __len__(self):
+            return len(order)
+
+        def __getitem__(self, i):
+            image = self.fn(int(order[i]))
+            return 0 if image is None else image.shape[0]
+
+    readers = [("folder", lambda i: cv2.imread(image_root + "/" + names[i])), ("lmdb", store.get)]
+    for title, fn in readers:
+        loader = data.DataLoader(Reader(fn), batch_size=batch_size, num_workers=workers)
+        start = time.time()
+        for _ in loader:
+            pass
+        elapsed = time.time() - start
+        print("%-6s %d samples in %.2fs: %.1f samples/s (%d workers)" % (title, len(order), elapsed, len(order) / elapsed, workers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Kaggle DR images to LMDB shards')
+    parser.add_argument('data', metavar='DIR', help='data root')
+    parser.add_argument('--dr-root', default='', type=str,
+                        help='kaggle DR train root with data_list.txt and the images it names (default: DIR/kaggle_dr)')
+    parser.add_argument('--out', required=True, type=str, help='store directory')
+    parser.add_argument('--shards', default=8, type=int)
+    parser.add_argument('--size', default=512, type=int, help='shorter side after resizing (0: keep)')
+    parser.add_argument('--raw', action='store_true', help='store raw uint8 instead of jpeg')
+    parser.add_argument('--quality', default=95, type=int)
+    parser.add_argument('--threads', default=8, type=int)
+    parser.add_argument('--bench', default=0, type=int, metavar='N',
+                        help='benchmark N samples against the folder reader instead of converting')
+    parser.add_argument('-j', '--workers', default=4, type=int)
+    args = parser.parse_args()
+    from datasets.fundus_kaggle_dr import dr_roots
+    dr_root = dr_roots(args.data, args)[0]
+
+    if args.bench:
+        benchmark(dr_root, args.out, args.bench, args.workers)
+    else:
+        convert(dr_root + "/data_list.txt", dr_root, args.out, args.shards, args.size, args.raw, args.quality, args.threads)
@@ -0,0 +1,190 @@
+"""manifest.csv files describing an image directory, one row per image.
+
+datasets/preprocess.py writes one next to the images it produces (name,
+label, output and source dimensions, field-of-view crop). load_images
+checks the images it is asked for against the manifest of their directory,
+so a partially preprocessed layout fails with the missing names instead of
+None images further down.
+
+load_index builds a binary index of an image list instead (path, bytes,
+height, width, label, inode, mtime), reading only the image header (and
+the last bytes of a JPEG, for truncation) of every file with a thread
+pool and caching the arrays in <list>.index.npz, keyed by a checksum of
+the paths and labels. Later startups only stat the files and rescan those
+whose size, inode or mtime changed since, so deleted or replaced images
+are caught without reading every file again. select() drops missing or
+corrupt entries before any worker touches them and can order the rest by
+inode, which on most filesystems follows allocation order, for sequential
+reads of an unshuffled set; lib.samplers.LocalitySampler does the same for
+shuffled training.
+"""
+import csv
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+MANIFEST = "manifest.csv"
+_manifests = {}
+_indexes = {}
+# bumped when the cached index layout changes
+INDEX_VERSION = 2
+
+
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST)
+
+
+def parse(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def write_manifest(path, rows, fields):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def read_manifest(path):
+    """Rows of a manifest as dicts, integer columns converted."""
+    with open(path, newline="") as f:
+        return [{key: parse(value) for key, value in row.items()} for row in csv.DictReader(f)]
+
+
+def manifest_names(directory):
+    """Names listed in directory's manifest.csv (memoised), None without one."""
+    directory = os.path.abspath(directory)
+    if directory not in _manifests:
+        path = manifest_path(directory)
+        _manifests[directory] = set(row["name"] for row in read_manifest(path)) if os.path.exists(path) else None
+    return _manifests[directory]
+
+
+def check_paths(paths):
+    """Raise when paths are missing from the manifest of their directory."""
+    missing = []
+    for path in paths:
+        names = manifest_names(os.path.dirname(path))
+        if names is not None and os.path.basename(path) not in names:
+            missing.append(path)
+    if missing:
+        raise FileNotFoundError("%d images not in their manifest.csv (rerun datasets/preprocess.py?): %s"
+                                % (len(missing), ", ".join(missing[:5]) + (" ..." if len(missing) > 5 else "")))
+
+
+def stat_file(path):
+    """(bytes, inode, mtime in ns) of a file, zeros when it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0, 0
+    return stat.st_size, stat.st_ino, stat.st_mtime_ns
+
+
+def scan_file(path):
+    """(bytes, height, width, inode, mtime in ns) of an image file, reading
+    its header and, for a JPEG, its last bytes; height and width are 0 when
+    it is missing, truncated or not an image."""
+    height = width = 0
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            truncated = False
+            if path.lower().endswith((".jpg", ".jpeg")):
+                f.seek(max(0, stat.st_size - 64))
+                truncated = not f.read().rstrip(b"\0").endswith(b"\xff\xd9")
+                f.seek(0)
+            if not truncated:
+                try:
+                    # header only, no decoding
+                    width, height = Image.open(f).size
+                except (OSError, SyntaxError):
+                    pass
+    except OSError:
+        return 0, 0, 0, 0, 0
+    return stat.st_size, height, width, stat.st_ino, stat.st_mtime_ns
+
+
+def scan(paths, threads):
+    """scan_file of every path as columns bytes, height, width, inode, mtime."""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        scanned = np.array(list(pool.map(scan_file, paths, chunksize=64)), dtype=np.int64).reshape(-1, 5)
+    return {"bytes": scanned[:, 0], "height": scanned[:, 1], "width": scanned[:, 2],
+            "inode": scanned[:, 3].astype(np.uint64), "mtime": scanned[:, 4]}
+
+
+def refresh(index, threads):
+    """Rescan the entries of a cached index whose file changed size, inode
+    or mtime (or disappeared) since it was written; True if any did."""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        stats = np.array(list(pool.map(stat_file, index["path"], chunksize=256)), dtype=np.int64).reshape(-1, 3)
+    changed = np.flatnonzero((stats[:, 0] != index["bytes"]) | (stats[:, 1] != index["inode"].astype(np.int64)) |
+                             (stats[:, 2] != index["mtime"]))
+    if len(changed) == 0:
+        return False
+    print("rescanning %d images changed since the index was written" % len(changed))
+    rescanned = scan(list(index["path"][changed]), threads)
+    for name, values in rescanned.items():
+        index[name][changed] = values
+    return True
+
+
+def load_index(list_file, paths, labels, threads=8):
+    """dict of arrays path, bytes, height, width, label, inode, mtime
+    for paths, memoised per process and cached next to list_file (entries
+    whose file changed are rescanned when the cache is loaded)."""
+    labels = np.asarray(labels, dtype=np.int64)
+    checksum = zlib.crc32("\n".join(paths).encode() + labels.tobytes())
+    key = (os.path.abspath(list_file), checksum)
+    if key in _indexes:
+        return _indexes[key]
+
+    start = time.time()
+    cache = list_file + ".index.npz"
+    index = None
+    changed = False
+    if os.path.exists(cache):
+        saved = np.load(cache)
+        # caches of an older layout are rebuilt
+        version = int(saved["version"]) if "version" in saved.files else 1
+        if int(saved["checksum"]) == checksum and version == INDEX_VERSION:
+            index = dict((name, saved[name]) for name in saved.files if name not in ("checksum", "version"))
+            changed = refresh(index, threads)
+            print("loaded the index of %d images from %s in %.0fms" % (len(paths), cache, 1000 * (time.time() - start)))
+
+    if index is None:
+        index = scan(paths, threads)
+        index.update(path=np.array(paths), label=labels)
+        print("indexed %d images (%.1f GB) in %.1fs with %d threads"
+              % (len(paths), index["bytes"].sum() / 2. ** 30, time.time() - start, threads))
+        changed = True
+
+    if changed:
+        try:
+            np.savez(cache, checksum=checksum, version=INDEX_VERSION, **index)
+        except OSError:
+            print("could not write index cache", cache)
+
+    _indexes[key] = index
+    return index
+
+
+def select(index, order="list"):
+    """Positions of the readable entries of an index, in list order or by
+    inode; missing or corrupt entries are reported and left out."""
+    valid = index["height"] > 0
+    if not valid.all():
+        bad = index["path"][~valid]
+        print("skipping %d missing or corrupt images: %s" % (len(bad), ", ".join(bad[:5]) + (" ..." if len(bad) > 5 else "")))
+    keep = np.flatnonzero(valid)
+    if order == "inode":
+        keep = keep[np.argsort(index["inode"][keep], kind="stable")]
+    return keep
@@ -0,0 +1,94 @@
+"""Pretraining on several fundus sources at once.
+
+SOURCES names the dataset modules the trainers can use (--dataset, and
+--sources amd:1,dr:2 for a mixture). MixtureDataset concatenates the
+training sets of the sources behind global indices (source s owns
+offsets[s] .. offsets[s + 1] - 1), so every sample has its own memory bank
+row; lib.samplers.MixtureSampler draws from the sources at the given
+ratios. Each source keeps its own loading: the challenge sets decode into
+RAM when built, Kaggle DR reads every sample from disk (or LMDB) when it
+is drawn.
+
+The sources disagree on the target they return ([target] or a bare int
+without --multitask), so MixtureDataset brings every item to one
+structure for default_collate. --synthesis is refused: the synthesis
+sources return 4 views, Kaggle DR 2.
+"""
+import importlib
+
+import numpy as np
+import torch.utils.data as data
+
+SOURCES = {
+    "amd": ("datasets.fundus_amd_syn_crossvalidation", "datasets.fundus_amd_syn_crossvalidation"),
+    "gon": ("datasets.fundus_gon_crossvalidation", "datasets.fundus_gon_syn_crossvalidation"),
+    "pm": ("datasets.fundus_pm_crossvalidation", "datasets.fundus_pm_syn_crossvalidation"),
+    "dr": ("datasets.fundus_kaggle_dr", "datasets.fundus_kaggle_dr"),
+}
+
+
+def source_module(name, args=None):
+    """The dataset module of a source (its synthesis variant with --synthesis)."""
+    plain, synthesis = SOURCES[name]
+    return importlib.import_module(synthesis if getattr(args, "synthesis", False) else plain)
+
+
+def parse_sources(spec):
+    """"amd:1,dr:2" -> [("amd", 1.0), ("dr", 2.0)]; a missing weight is 1."""
+    sources = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name not in SOURCES:
+            raise ValueError("unknown source %s (one of %s)" % (name, ", ".join(sorted(SOURCES))))
+        sources.append((name, float(weight) if weight else 1.))
+    return sources
+
+
+class MixtureDataset(data.Dataset):
+    """The sources' samples behind global indices. Items come back as the
+    source returns them with the index replaced by the global one, the
+    name prefixed with the source and the target as [target, rotation
+    label] with multitask, else a bare int. transform and train are set on
+    every source."""
+
+    def __init__(self, datasets, names, multitask=False):
+        self.__dict__["datasets"] = list(datasets)
+        self.__dict__["names"] = list(names)
+        self.__dict__["multitask"] = multitask
+        self.__dict__["offsets"] = np.cumsum([0] + [len(dataset) for dataset in datasets])
+        for name, dataset in zip(names, datasets):
+            print("mixture source %s: %d samples" % (name, len(dataset)))
+
+    def __setattr__(self, name, value):
+        if name in ("transform", "train"):
+            for dataset in self.datasets:
+                setattr(dataset, name, value)
+        self.__dict__[name] = value
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets).tolist()
+
+    @property
+    def targets(self):
+        return [target for dataset in self.datasets for target in dataset.targets]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        s = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        item = self.datasets[s][int(idx) - int(self.offsets[s])]
+        target = item[1] if isinstance(item[1], list) else [item[1]]
+        target = [int(t) for t in target] if self.multitask else int(target[0])
+        return (item[0], target, int(idx), "%s/%s" % (self.names[s], item[3])) + tuple(item[4:])
+
+
+def mixture(spec, transform, args):
+    """MixtureDataset of the training sets named in spec and their weights."""
+    if getattr(args, "synthesis", False):
+        raise ValueError("--sources cannot be combined with --synthesis: its sources return 4 views, kaggle DR 2")
+    sources = parse_sources(spec)
+    datasets = [source_module(name, args).traindataset(root=args.data, transform=transform, train=True, args=args)
+                for name, _ in sources]
+    return MixtureDataset(datasets, [name for name, _ in sources], args.multitask), [weight for _, weight in sources]
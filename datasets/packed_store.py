@@ -0,0 +1,112 @@
+"""All resized images of a dataset packed into one contiguous uint8 file.
+
+<out>.bin holds the raw HxWxC bytes back to back, <out>.npz the index:
+keys (path relative to the data root), offsets, shapes, names and labels.
+Datasets read zero-copy views of the memory map, so building a dataset only
+loads the index and forked DataLoader workers share the page cache instead
+of copying python lists of arrays.
+
+    python -m datasets.packed_store ./data amd --syn --out ./data/packed/amd
+    python main.py ./data ... --packed ./data/packed/amd
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from datasets.image_loader import load_images
+
+# directories (relative to the data root) and positive-class name prefix
+PRESETS = {
+    "amd": (["Training400/resized_image_320"],
+            ["Training400/resized_image_syn"], "A"),
+    "gon": (["iChanllenge-Gon/Training400/resized_images_320"],
+            ["iChanllenge-Gon/Training400/resized_image_syn",
+             "iChanllenge-Gon/Training400/resized_image_syn_early"], "g"),
+    "pm": (["PAML/resized_image_320"],
+           ["PAML/resized_image_syn"], "P"),
+}
+
+
+def relative_key(path, root):
+    return os.path.relpath(os.path.normpath(path), os.path.normpath(root))
+
+
+class PackedStore(object):
+
+    def __init__(self, prefix):
+        index = np.load(prefix + ".npz")
+        self.keys = list(index["keys"])
+        self.offsets = index["offsets"]
+        self.shapes = index["shapes"]
+        self.names = list(index["names"])
+        self.labels = index["labels"]
+        self.lookup = dict((key, i) for i, key in enumerate(self.keys))
+        self.data = np.memmap(prefix + ".bin", dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.lookup
+
+    def get(self, key):
+        i = self.lookup[key]
+        start = self.offsets[i]
+        return self.data[start:start + int(np.prod(self.shapes[i]))].reshape(self.shapes[i])
+
+
+_stores = {}
+
+
+def open_store(prefix):
+    """One PackedStore per prefix and process."""
+    if prefix not in _stores:
+        _stores[prefix] = PackedStore(prefix)
+    return _stores[prefix]
+
+
+def pack(root, dirs, out, positive="", args=None):
+    keys = []
+    for folder in dirs:
+        files = sorted(glob.glob(os.path.join(root, folder, "*.jpg")) + glob.glob(os.path.join(root, folder, "*.png")))
+        if not files:
+            print("skip", folder, "(no images)")
+            continue
+        keys += [relative_key(item, root) for item in files]
+
+    images = load_images([os.path.join(root, key) for key in keys], args, "images to pack")
+    keep = [i for i, image in enumerate(images) if image is not None]
+    keys = [keys[i] for i in keep]
+    images = [images[i] for i in keep]
+
+    shapes = np.array([image.shape for image in images], dtype=np.int64)
+    sizes = np.prod(shapes, axis=1)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    names = [key.split("/")[-1] for key in keys]
+    labels = np.array([1 if positive and name[0] == positive else 0 for name in names], dtype=np.int64)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    data = np.memmap(out + ".bin", dtype=np.uint8, mode="w+", shape=(int(sizes.sum()),))
+    for image, start, size in zip(images, offsets, sizes):
+        data[start:start + size] = image.reshape(-1)
+    data.flush()
+    del data
+
+    np.savez(out + ".npz", keys=np.array(keys), offsets=offsets, shapes=shapes,
+             names=np.array(names), labels=labels)
+    print("packed %d images (%.1f MB) into %s.bin" % (len(keys), sizes.sum() / 2. ** 20, out))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack resized fundus images into one uint8 memmap')
+    parser.add_argument('data', metavar='DIR', help='data root, as passed to the trainers')
+    parser.add_argument('dataset', choices=sorted(PRESETS.keys()))
+    parser.add_argument('--out', required=True, type=str, help='output prefix (<out>.bin, <out>.npz)')
+    parser.add_argument('--syn', action='store_true', help='also pack the synthetic images')
+    parser.add_argument('--load-threads', default=0, type=int)
+    args = parser.parse_args()
+
+    dirs, syn_dirs, positive = PRESETS[args.dataset]
+    pack(args.data, dirs + (syn_dirs if args.syn else []), args.out, positive, args)
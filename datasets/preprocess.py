@@ -0,0 +1,120 @@
+"""Raw fundus photographs to the resized_image_320 layout.
+
+Every image under the raw directory (searched recursively) is cropped to
+its circular field of view, padded to a square with black, resized to
+--size x --size and written as <out>/<name>.jpg, so later epochs spend
+their pixels on retina instead of black borders. The field of view is the
+bounding box of the rows and columns where enough pixels are brighter than
+--threshold, found on a 4x downscaled copy. <out>/manifest.csv records
+name, label (1 when the name starts with --positive), the source and
+output dimensions and the crop box. Images are processed by --workers
+processes.
+
+    python -m datasets.preprocess ./data/raw/Training400 ./data/Training400/resized_image_320 --size 320 --positive A
+"""
+import argparse
+import glob
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from datasets.manifest import manifest_path, write_manifest
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+FIELDS = ["name", "label", "height", "width", "src_height", "src_width",
+          "crop_top", "crop_left", "crop_bottom", "crop_right"]
+
+
+def field_of_view(image, threshold=15, fraction=0.01, scale=4):
+    """(top, left, bottom, right) of the bright field of view of a BGR
+    image, the whole image when nothing passes the threshold."""
+    h, w = image.shape[:2]
+    small = cv2.resize(image, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA)
+    mask = small.max(axis=2) > threshold
+    rows = np.flatnonzero(mask.sum(1) > fraction * mask.shape[1])
+    cols = np.flatnonzero(mask.sum(0) > fraction * mask.shape[0])
+    if len(rows) == 0 or len(cols) == 0:
+        return 0, 0, h, w
+    sy, sx = h / float(mask.shape[0]), w / float(mask.shape[1])
+    return (int(rows[0] * sy), int(cols[0] * sx),
+            min(h, int(np.ceil((rows[-1] + 1) * sy))), min(w, int(np.ceil((cols[-1] + 1) * sx))))
+
+
+def square(image):
+    """image padded with black to a centred square."""
+    h, w = image.shape[:2]
+    side = max(h, w)
+    top, left = (side - h) // 2, (side - w) // 2
+    return cv2.copyMakeBorder(image, top, side - h - top, left, side - w - left, cv2.BORDER_CONSTANT, value=0)
+
+
+def crop_fundus(image, size, threshold=15):
+    box = field_of_view(image, threshold)
+    top, left, bottom, right = box
+    out = square(image[top:bottom, left:right])
+    interpolation = cv2.INTER_AREA if out.shape[0] > size else cv2.INTER_CUBIC
+    return cv2.resize(out, (size, size), interpolation=interpolation), box
+
+
+class Job(object):
+
+    def __init__(self, out, size, threshold, quality, positive):
+        self.out = out
+        self.size = size
+        self.threshold = threshold
+        self.quality = quality
+        self.positive = positive
+
+    def __call__(self, path):
+        cv2.setNumThreads(1)
+        image = cv2.imread(path)
+        if image is None:
+            return None
+        out, (top, left, bottom, right) = crop_fundus(image, self.size, self.threshold)
+        name = os.path.splitext(os.path.basename(path))[0] + ".jpg"
+        cv2.imwrite(os.path.join(self.out, name), out, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return {"name": name, "label": int(bool(self.positive) and name.startswith(self.positive)),
+                "height": out.shape[0], "width": out.shape[1],
+                "src_height": image.shape[0], "src_width": image.shape[1],
+                "crop_top": top, "crop_left": left, "crop_bottom": bottom, "crop_right": right}
+
+
+def preprocess(raw, out, size=320, workers=8, threshold=15, quality=95, positive=""):
+    paths = sorted(path for path in glob.glob(os.path.join(raw, "**", "*"), recursive=True)
+                   if path.lower().endswith(EXTENSIONS))
+    os.makedirs(out, exist_ok=True)
+    start = time.time()
+    rows, failed = [], []
+    with Pool(workers) as pool:
+        for n, (path, row) in enumerate(zip(paths, pool.imap(Job(out, size, threshold, quality, positive), paths, chunksize=8))):
+            if row is None:
+                failed.append(path)
+            else:
+                rows.append(row)
+            if (n + 1) % 500 == 0:
+                print("  %d/%d (%.1fs)" % (n + 1, len(paths), time.time() - start))
+
+    write_manifest(manifest_path(out), rows, FIELDS)
+    kept = np.mean([(r["crop_bottom"] - r["crop_top"]) * (r["crop_right"] - r["crop_left"]) /
+                    float(r["src_height"] * r["src_width"]) for r in rows]) if rows else 0.
+    print("wrote %d images of %dx%d to %s in %.1fs with %d workers (field of view %.0f%% of the source on average)"
+          % (len(rows), size, size, out, time.time() - start, workers, 100 * kept))
+    if failed:
+        print("unreadable:", failed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crop raw fundus images to their field of view and resize them')
+    parser.add_argument('raw', metavar='DIR', help='raw images, searched recursively')
+    parser.add_argument('out', metavar='OUT', help='output directory, e.g. ./data/Training400/resized_image_320')
+    parser.add_argument('--size', default=320, type=int)
+    parser.add_argument('-j', '--workers', default=os.cpu_count() or 1, type=int)
+    parser.add_argument('--threshold', default=15, type=int, help='brightness above which a pixel is retina')
+    parser.add_argument('--quality', default=95, type=int)
+    parser.add_argument('--positive', default='', type=str, help='name prefix of positive images (A, g, P)')
+    args = parser.parse_args()
+
+    preprocess(args.raw, args.out, args.size, args.workers, args.threshold, args.quality, args.positive)
@@ -0,0 +1,20 @@
+from datasets.batched import DatasetWrapper
+from lib.seeding import sample_rng
+
+
+class SeededDataset(DatasetWrapper):
+    """Loads every sample inside lib.seeding.sample_rng(run, epoch, index),
+    taking the epoch from the SeededIndex the sampler yields (0 for plain
+    ints), so its augmentations depend only on the run, epoch and index."""
+
+    def __init__(self, dataset, run):
+        DatasetWrapper.__init__(self, dataset, run=run)
+
+    def __getitem__(self, idx):
+        with sample_rng(self.run, getattr(idx, "epoch", 0), int(idx)):
+            return self.dataset[int(idx)]
+
+
+def seeded(dataset, args, run):
+    """dataset wrapped in SeededDataset when args.seeded_aug is set."""
+    return SeededDataset(dataset, run) if getattr(args, "seeded_aug", False) else dataset
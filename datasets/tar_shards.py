@@ -0,0 +1,190 @@
+"""Kaggle DR training images (or any unlabeled fundus list) as sequential
+tar shards, streamed for out-of-core pretraining.
+
+Every shard holds %08d.jpg (resized to --size, shorter side) and %08d.json
+({"index", "name", "target"}) per sample, in an order shuffled once at
+write time; index.json lists the shards and their sample counts. Readers
+stream whole shards front to back, so reads stay sequential whatever the
+dataset size. Each epoch the shard order is reshuffled, shards are dealt
+to distributed ranks and then to DataLoader workers, and samples are mixed
+through a shuffle buffer before being turned into the usual
+(views, targets, index, name) tuples.
+
+    python -m datasets.tar_shards ./data --out ./data/kaggle_dr/shards --shard-size 2000 --size 512
+    python -m datasets.tar_shards ./data --dr-root /mnt/kaggle_dr --out ./data/kaggle_dr/shards
+    python kaggle_main.py ./data ... --shards ./data/kaggle_dr/shards
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+import torch.utils.data as data
+
+from datasets.fundus_kaggle_dr import dr_roots, traindataset
+from datasets.lmdb_store import encode, resize_shorter
+from lib.seeding import sample_rng
+
+
+def shard_name(shard):
+    return "shard-%05d.tar" % shard
+
+
+def add_member(tar, name, payload):
+    info = tarfile.TarInfo(name)
+    info.size = len(payload)
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(payload))
+
+
+def convert(list_file, image_root, out, shard_size=2000, size=512, quality=95, threads=8, seed=0):
+    """Shard the images named in list_file (relative to image_root)."""
+    names = list(np.genfromtxt(list_file, dtype='str'))
+    order = np.random.RandomState(seed).permutation(len(names)) if seed >= 0 else np.arange(len(names))
+    os.makedirs(out, exist_ok=True)
+
+    def load(i):
+        image = cv2.imread(image_root + "/" + names[i])
+        return None if image is None else encode(resize_shorter(image, size), False, quality)
+
+    start = time.time()
+    shards, missing = [], []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for shard, begin in enumerate(range(0, len(order), shard_size)):
+            indices = order[begin:begin + shard_size].tolist()
+            count = 0
+            with tarfile.open(os.path.join(out, shard_name(shard)), "w") as tar:
+                for i, value in zip(indices, pool.map(load, indices)):
+                    if value is None:
+                        missing.append(names[i])
+                        continue
+                    add_member(tar, "%08d.jpg" % i, value)
+                    add_member(tar, "%08d.json" % i, json.dumps({"index": i, "name": names[i], "target": 0}).encode())
+                    count += 1
+            shards.append({"file": shard_name(shard), "count": count})
+            print("  %s: %d samples (%.1fs)" % (shard_name(shard), count, time.time() - start))
+
+    with open(os.path.join(out, "index.json"), "w") as f:
+        json.dump({"count": len(names), "shards": shards}, f)
+    print("wrote %d images into %d shards at %s in %.1fs" % (len(names) - len(missing), len(shards), out, time.time() - start))
+    if missing:
+        print("missing or unreadable:", missing)
+
+
+def read_shard(path):
+    """(index, name, target, BGR image) of every sample of a shard, reading
+    the file front to back."""
+    with open(path, "rb", buffering=1 << 22) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+        key, image, meta = None, None, None
+        for member in tar:
+            stem, ext = os.path.splitext(member.name)
+            if stem != key:
+                key, image, meta = stem, None, None
+            payload = tar.extractfile(member).read()
+            if ext == ".jpg":
+                image = payload
+            elif ext == ".json":
+                meta = json.loads(payload)
+            if image is not None and meta is not None:
+                yield meta["index"], meta["name"], meta["target"], \
+                      cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+                key = None
+
+
+def world():
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+class TarShardDataset(data.IterableDataset):
+    """Streams the shards under path as fundus_kaggle_dr.traindataset
+    training tuples (index is the global sample index, len(self) the
+    samples of this rank). Call set_epoch before iterating; with run set,
+    augmentations are drawn from lib.seeding.sample_rng(run, epoch, index).
+    For equal epochs across ranks and workers the shard count should be a
+    multiple of world size * num_workers."""
+
+    # the (views, targets, index, name) construction of the folder dataset
+    sample = traindataset.sample
+
+    def __init__(self, path, transform=None, args=None, buffer=2048, seed=0, run=None):
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+        self.path = path
+        self.shards = [item["file"] for item in index["shards"]]
+        self.counts = [item["count"] for item in index["shards"]]
+        self.count = index["count"]
+        self.transform = transform
+        self.train = True
+        self.numpy_input = getattr(args, "aug_backend", "pil") == "cv2"
+        self.multitask = args.multitask
+        self.multiaug = args.multiaug
+        self.buffer = buffer
+        self.seed = seed
+        self.run = run
+        self.epoch = 0
+        print("train data: %d samples in %d shards at %s" % (self.count, len(self.shards), path))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def rank_shards(self):
+        order = random.Random(self.seed + self.epoch).sample(range(len(self.shards)), len(self.shards))
+        rank, size = world()
+        return order[rank::size]
+
+    def __len__(self):
+        return sum(self.counts[s] for s in self.rank_shards())
+
+    def __iter__(self):
+        shards = self.rank_shards()
+        worker = data.get_worker_info()
+        if worker is not None:
+            shards = shards[worker.id::worker.num_workers]
+        rank = world()[0]
+        rng = random.Random("%d-%d-%d-%d" % (self.seed, self.epoch, rank, worker.id if worker is not None else 0))
+
+        buffer = []
+        for shard in shards:
+            for item in read_shard(os.path.join(self.path, self.shards[shard])):
+                if len(buffer) < self.buffer:
+                    buffer.append(item)
+                    continue
+                # emit a random buffered sample, keep the new one in its place
+                j = rng.randrange(len(buffer))
+                buffer[j], item = item, buffer[j]
+                yield self.make(*item)
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield self.make(*item)
+
+    def make(self, idx, name, target, image):
+        if self.run is None:
+            return self.sample(image, target, idx, name)
+        with sample_rng(self.run, self.epoch, idx):
+            return self.sample(image, target, idx, name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Kaggle DR images to tar shards')
+    parser.add_argument('data', metavar='DIR', help='data root')
+    parser.add_argument('--dr-root', default='', type=str,
+                        help='kaggle DR train root with data_list.txt and the images it names (default: DIR/kaggle_dr)')
+    parser.add_argument('--out', required=True, type=str, help='shard directory')
+    parser.add_argument('--shard-size', default=2000, type=int, help='samples per shard')
+    parser.add_argument('--size', default=512, type=int, help='shorter side after resizing (0: keep)')
+    parser.add_argument('--quality', default=95, type=int)
+    parser.add_argument('--threads', default=8, type=int)
+    parser.add_argument('--seed', default=0, type=int, help='write-time shuffle (-1: keep data_list.txt order)')
+    args = parser.parse_args()
+    dr_root = dr_roots(args.data, args)[0]
+
+    convert(dr_root + "/data_list.txt", dr_root, args.out, args.shard_size, args.size, args.quality, args.threads, args.seed)
@@ -13,17 +13,26 @@ import torch.optim
 import torch.utils.data
 import torch.utils.data.distributed
 import torchvision.transforms as transforms
+import lib.cv_transforms as cv_transforms
 
 import datasets
 import models
 import math
 import random
+from lib.collate import ViewCollate, cat_views
+from lib.samplers import EpochSampler, LocalitySampler, WorkerAffineBatchSampler
+from lib.seeding import worker_init
 from lib.NCEAverage import NCEAverage
 from lib.LinearAverage import LinearAverage
 from lib.NCECriterion import NCECriterion
 from lib.BatchAverage import BatchCriterion
 from lib.BatchAverageRot import BatchCriterionRot
 from lib.utils import AverageMeter
+from datasets.batched import batched
+from datasets.seeded import seeded
+from datasets.tar_shards import TarShardDataset
+from datasets.image_cache import WorkerCacheStats
+from lib.batch_augment import Uint8Normalize
 from test import kNN
 import numpy as np
 
@@ -46,6 +55,16 @@ parser.add_argument('--arch', '-a', metavar='ARCH', default='resnet18',
                         ' (default: resnet18)')
 parser.add_argument('-j', '--workers', default=4, type=int, metavar='N',
                     help='number of data loading workers (default: 4)')
+parser.add_argument('--aug-backend', default='pil', choices=['pil', 'cv2'],
+                    help='augment PIL images with torchvision or uint8 arrays with lib/cv_transforms.py (RGB, as ImageNet normalisation expects)')
+parser.add_argument('--uint8-transfer', action='store_true',
+                    help='training views leave the workers as uint8 and are normalised per batch on the GPU')
+parser.add_argument('--seeded-aug', action='store_true',
+                    help='draw augmentations from per (run, epoch, sample) seeds, identical for any number of workers')
+parser.add_argument('--view-collate', action='store_true',
+                    help='collate training views into one [views * B, C, H, W] shared-memory tensor in the layout the criterion expects')
+parser.add_argument('--fetch-threads', default=0, type=int, metavar='N',
+                    help='decode and augment each training batch with N threads per loader worker (default: 0, per sample)')
 parser.add_argument('--epochs', default=300, type=int, metavar='N',
                     help='number of total epochs to run')
 parser.add_argument('--start-epoch', default=0, type=int, metavar='N',
@@ -89,13 +108,37 @@ parser.add_argument('--multitask', action="store_true")
 parser.add_argument("--multitaskposrot", action="store_true")
 parser.add_argument('--domain', action="store_true")
 parser.add_argument("--saveembed", type=str, default="")
+parser.add_argument("--lmdb", type=str, default="",
+                    help='kaggle DR train images from a datasets/lmdb_store.py store')
+parser.add_argument("--dr-root", type=str, default="",
+                    help='kaggle DR train root with data_list.txt (default: DIR/kaggle_dr)')
+parser.add_argument("--dr-test-root", type=str, default="",
+                    help='kaggle DR test root with test_id.txt, test_label.txt and resized_test/ (default: --dr-root)')
+parser.add_argument("--dr-order", default="list", choices=["list", "inode"],
+                    help='read order of the DR images: data_list.txt order, or on-disk (inode) order for the test set and '
+                         'shuffled inode-sorted chunks (--dr-chunk) for training')
+parser.add_argument("--dr-chunk", default=2048, type=int,
+                    help='with --dr-order inode, training images per chunk of on-disk neighbours shuffled together')
+parser.add_argument("--dr-cache-mb", default=0, type=float,
+                    help='decoded DR train images cached per loader worker, in MB, with worker-affine batches (0: off)')
+parser.add_argument("--dr-cache-size", default=512, type=int,
+                    help='shorter side of the images in the --dr-cache-mb cache')
+parser.add_argument("--shards", type=str, default="",
+                    help='stream train images from datasets/tar_shards.py shards in this directory')
+parser.add_argument("--shuffle-buffer", default=2048, type=int,
+                    help='samples per loader worker mixed before streaming them with --shards')
 
 best_prec1 = 0
+normalize_uint8 = Uint8Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 
 def main():
 
     global args, best_prec1
     args = parser.parse_args()
+    if args.shards and args.evaluate:
+        parser.error("--evaluate extracts features in dataset order, use the folder or --lmdb dataset")
+    if args.shards and args.dr_cache_mb > 0:
+        parser.error("--dr-cache-mb caches the folder or --lmdb dataset, not --shards")
 
     my_whole_seed = 111
     random.seed(my_whole_seed)
@@ -120,15 +163,18 @@ def main():
         model = torch.nn.DataParallel(model).cuda()
 
         # Data loading code
+        T = cv_transforms if args.aug_backend == 'cv2' else transforms
         normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                          std=[0.229, 0.224, 0.225])
 
-        aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.2, 1.)),
-                                  transforms.RandomGrayscale(p=0.2),
-                                  transforms.ColorJitter(0.4, 0.4, 0.4, 0.4),
-                                  transforms.RandomHorizontalFlip(),
-                                  transforms.ToTensor(),
-                                  normalize])
+        to_tensor = [T.ToTensor(), normalize]
+        if args.uint8_transfer:
+            # workers ship uint8 views; normalize_uint8 converts whole batches on the GPU
+            to_tensor = [cv_transforms.ToUint8Tensor() if T is cv_transforms else transforms.PILToTensor()]
+        aug = T.Compose([T.RandomResizedCrop(224, scale=(0.2, 1.)),
+                         T.RandomGrayscale(p=0.2),
+                         T.ColorJitter(0.4, 0.4, 0.4, 0.4),
+                         T.RandomHorizontalFlip()] + to_tensor)
         # aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.08, 1.), ratio=(3 / 4, 4 / 3)),
         #                           transforms.RandomHorizontalFlip(p=0.5),
         #                           get_color_distortion(s=1),
@@ -142,36 +188,62 @@ def main():
         #                           transforms.RandomHorizontalFlip(),
         #                           transforms.ToTensor(),
         #                             normalize])
-        aug_test = transforms.Compose([
-                transforms.Resize(224),
-                transforms.ToTensor(),
+        aug_test = T.Compose([
+                T.Resize(224),
+                T.ToTensor(),
                 normalize])
 
         # dataset
         import datasets.fundus_kaggle_dr as medicaldata
-        train_dataset = medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args)
-        train_loader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=8, drop_last=True if args.multiaug else False,  worker_init_fn=random.seed(my_whole_seed))
+        # the multiaug branch without --domain hands the list of views to the model as is
+        layout = 'cat' if args.multitask else 'interleave' if args.domain else None
+        train_collate = ViewCollate(layout) if args.view_collate and layout else None
+        if args.shards:
+            # shuffled by shard order and a per-worker buffer instead of a sampler
+            train_dataset = TarShardDataset(args.shards, transform=aug, args=args, buffer=args.shuffle_buffer, seed=my_whole_seed,
+                                            run=my_whole_seed if args.seeded_aug else None)
+            train_sampler = None
+            train_loader = torch.utils.data.DataLoader(
+                train_dataset, batch_size=args.batch_size, collate_fn=train_collate, pin_memory=True, num_workers=8, drop_last=True if args.multiaug else False, worker_init_fn=worker_init(my_whole_seed))
+        elif args.dr_cache_mb > 0:
+            # every sample stays with one persistent worker, whose cache then serves it from the second epoch on
+            train_dataset = batched(seeded(medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args), args, my_whole_seed), args)
+            cache_stats = WorkerCacheStats(8)
+            train_dataset.cache_stats = cache_stats
+            train_sampler = WorkerAffineBatchSampler(len(train_dataset), args.batch_size, 8, shuffle=True, seed=my_whole_seed)
+            train_loader = torch.utils.data.DataLoader(
+                train_dataset, batch_sampler=train_sampler, collate_fn=train_collate, pin_memory=True, num_workers=8,
+                persistent_workers=True, worker_init_fn=worker_init(my_whole_seed))
+        else:
+            train_dataset = batched(seeded(medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args), args, my_whole_seed), args)
+            if args.dr_order == "inode" and train_dataset.inode is not None:
+                # shuffled, but every chunk of the epoch reads neighbouring files
+                train_sampler = LocalitySampler(train_dataset.inode, args.dr_chunk, seed=my_whole_seed)
+            else:
+                train_sampler = EpochSampler(len(train_dataset), shuffle=True, seed=my_whole_seed) if args.seeded_aug else None
+            train_loader = torch.utils.data.DataLoader(
+                train_dataset, batch_size=args.batch_size, shuffle=train_sampler is None, sampler=train_sampler, collate_fn=train_collate, pin_memory=True, num_workers=8, drop_last=True if args.multiaug else False,  worker_init_fn=worker_init(my_whole_seed))
 
 
         valid_dataset = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, test_type="amd", args=args)
         val_loader = torch.utils.data.DataLoader(
-            valid_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=8, worker_init_fn=random.seed(my_whole_seed))
+            valid_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=8, worker_init_fn=worker_init(my_whole_seed))
         valid_dataset_gon = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, test_type="gon",
                                                  args=args)
         val_loader_gon = torch.utils.data.DataLoader(
             valid_dataset_gon, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=8,
-            worker_init_fn=random.seed(my_whole_seed))
+            worker_init_fn=worker_init(my_whole_seed))
         valid_dataset_pm = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, test_type="pm",
                                                  args=args)
         val_loader_pm = torch.utils.data.DataLoader(
             valid_dataset_pm, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=8,
-            worker_init_fn=random.seed(my_whole_seed))
+            worker_init_fn=worker_init(my_whole_seed))
 
 
 
         # define lemniscate and loss function (criterion)
-        ndata = train_dataset.__len__()
+        # streamed shards index the bank with the global sample index
+        ndata = train_dataset.count if args.shards else train_dataset.__len__()
 
         lemniscate = LinearAverage(args.low_dim, ndata, args.nce_t, args.nce_m).cuda()
         local_lemniscate = None
@@ -242,10 +314,20 @@ def main():
         for epoch in range(args.start_epoch, args.epochs):
             lr = adjust_learning_rate(optimizer, epoch, args, [100, 200])
             writer.add_scalar("lr", lr, epoch)
+            if train_sampler is not None:
+                train_sampler.set_epoch(epoch)
+            if args.shards:
+                train_dataset.set_epoch(epoch)
 
             # # train for one epoch
             loss = train(train_loader, model, lemniscate, local_lemniscate, criterion, cls_criterion, optimizer, epoch, writer)
             writer.add_scalar("train_loss", loss, epoch)
+            if args.dr_cache_mb > 0:
+                stats = cache_stats.summary()
+                writer.add_scalar("cache/hit_rate", stats["recent_hit_rate"], epoch)
+                writer.add_scalar("cache/decode_s", stats["recent_decode_s"], epoch)
+                print("DR cache: epoch hit rate {recent_hit_rate:.3f} ({hit_rate:.3f} overall), {recent_decode_s:.1f}s decoding, "
+                      "{mb:.0f} MB cached".format(**stats))
 
             # gap_int = 10
             # if (epoch) % gap_int == 0:
@@ -300,9 +382,12 @@ def train(train_loader, model, lemniscate, local_lemniscate, criterion, cls_crit
         # measure data loading time
         data_time.update(time.time() - end)
 
+        if args.uint8_transfer:
+            input = normalize_uint8(input)
+
         # compute output
         if args.multitask:
-            input = torch.cat(input, 0).cuda()
+            input = cat_views(input).cuda()
             index = torch.cat([index, index], 0).cuda()
             rotation_label = torch.cat([target[1], target[1]], 0).cuda()
 
@@ -341,7 +426,10 @@ def train(train_loader, model, lemniscate, local_lemniscate, criterion, cls_crit
 
         elif args.multiaug:
 
-            if args.domain:
+            if args.domain and torch.is_tensor(input):
+                # interleaved by ViewCollate already
+                input = input.cuda()
+            elif args.domain:
                 dataX = torch.cat(input, 0).cuda()
                 ori_data = dataX[:int(dataX.shape[0] / 2)]
                 syn_data = dataX[int(dataX.shape[0] / 2):]
@@ -23,54 +23,34 @@ class BatchCriterionRot(nn.Module):
         self.T = T
         self.multitask = args.multitask
         # self.stripe = stripe
-        num = 8 if self.multitask else 2
-        self.diag_mat = 1 - torch.eye(batchSize * num).cuda()
+        # rotations per view (--rot-k); the rows of a view are grouped by k
+        self.k = getattr(args, "rot_k", 4)
 
     def forward(self, x, targets):
         batchSize = x.size(0)
+        k = self.k
 
         # get positive innerproduct
-
+        row = torch.arange(batchSize, device=x.device)
+        group, slot = row // k * k, row % k
+        # sized from the batch, so a last batch that is not full works too
+        diag_mat = 1 - torch.eye(batchSize, device=x.device, dtype=x.dtype)
 
         losses = 0
 
-        for i in range(0, 4):
+        for i in range(0, k):
             reordered_x = torch.cat((x.narrow(0, batchSize // 2, batchSize // 2), \
                                      x.narrow(0, 0, batchSize // 2)), 0)
 
-            if i == 1:
-                idx = list(np.arange(1, int(batchSize), 4))
-                idx1 = np.array([item+1 for item in idx])
-                idx2 = np.array([item + 2 for item in idx])
-                idx3 = np.array([item - 1 for item in idx])
-                idx = np.array(idx)
-                index = np.stack([idx, idx1, idx2, idx3])
-                index = list(index.flatten("F"))
-                reordered_x = reordered_x[index,:]
-            elif i == 2:
-                idx = list(np.arange(2, int(batchSize), 4))
-                idx1 = np.array([item + 1 for item in idx])
-                idx2 = np.array([item - 2 for item in idx])
-                idx3 = np.array([item - 1 for item in idx])
-                idx = np.array(idx)
-                index = np.stack([idx, idx1, idx2, idx3])
-                index = list(index.flatten("F"))
-                reordered_x = reordered_x[index,:]
-            elif i == 3:
-                idx = list(np.arange(3, int(batchSize), 4))
-                idx1 = np.array([item - 3 for item in idx])
-                idx2 = np.array([item - 2 for item in idx])
-                idx3 = np.array([item - 1 for item in idx])
-                idx = np.array(idx)
-                index = np.stack([idx, idx1, idx2, idx3])
-                index = list(index.flatten("F"))
-                reordered_x = reordered_x[index,:]
+            if i > 0:
+                # the other view of the sample, rotation slot j + i within its group
+                reordered_x = reordered_x[group + (slot + i) % k, :]
 
             # reordered_x = reordered_x.data
             pos = (x * reordered_x.data).sum(1).div_(self.T).exp_()
 
             # get all innerproduct, remove diag
-            all_prob = torch.mm(x, x.t().data).div_(self.T).exp_() * self.diag_mat
+            all_prob = torch.mm(x, x.t().data).div_(self.T).exp_() * diag_mat
 
 
             if self.negM == 1:
@@ -102,7 +82,7 @@ class BatchCriterionRot(nn.Module):
             losses += loss
 
 
-        return losses/4.0
+        return losses / float(k)
 
 
 
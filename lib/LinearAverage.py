@@ -71,3 +71,11 @@ class LinearAverage(nn.Module):
         out = LinearAverageOp.apply(x, y, self.memory, self.params)
         return out
 
+    def update(self, x, y):
+        # momentum update of rows y with x, as the backward pass does, for
+        # losses that do not go through the memory bank
+        with torch.no_grad():
+            momentum = self.params[1].item()
+            weight_pos = self.memory.index_select(0, y.view(-1)).mul_(momentum).add_(x.detach().mul(1 - momentum))
+            self.memory.index_copy_(0, y.view(-1), weight_pos.div(weight_pos.norm(dim=1, keepdim=True)))
+
@@ -0,0 +1,77 @@
+import torch
+from torch import nn
+
+
+class ClassPrototype(nn.Module):
+    ''' Per-class prototypes in the l2-normalised embedding space.
+        numProto=1 gives the class centroid, numProto>1 a spherical k-means
+        per class. Classification is one mm against numClass*numProto rows.
+    '''
+
+    def __init__(self, inputSize, numClass, numProto=1, seed=111):
+        super(ClassPrototype, self).__init__()
+        self.numClass = numClass
+        self.numProto = numProto
+        self.seed = seed
+
+        nProto = numClass * numProto
+        self.register_buffer('memory', torch.zeros(nProto, inputSize))
+        self.register_buffer('sums', torch.zeros(nProto, inputSize))
+        self.register_buffer('counts', torch.zeros(nProto))
+        self.register_buffer('labels', torch.arange(numClass).repeat_interleave(numProto))
+
+    def reset(self):
+        self.sums.zero_()
+        self.counts.zero_()
+
+    def assign(self, x, y):
+        # nearest prototype of the sample's own class
+        if self.numProto == 1:
+            return y
+        sim = torch.mm(x, self.memory.t()).view(x.size(0), self.numClass, self.numProto)
+        sim = torch.gather(sim, 1, y.view(-1, 1, 1).expand(-1, 1, self.numProto)).squeeze(1)
+        return y * self.numProto + sim.argmax(1)
+
+    def update(self, x, y):
+        ''' Incremental update with a batch of embeddings x and labels y;
+            the prototypes are the running means, renormalised.
+        '''
+        proto = self.assign(x, y)
+        self.sums.index_add_(0, proto, x)
+        self.counts.index_add_(0, proto, torch.ones_like(proto, dtype=self.counts.dtype))
+
+        seen = self.counts > 0
+        centroid = self.sums[seen] / self.counts[seen].unsqueeze(1)
+        self.memory[seen] = centroid / centroid.norm(dim=1, keepdim=True).clamp_min(1e-12)
+        return proto
+
+    def fit(self, x, y, iters=20):
+        ''' Fit from scratch on all training embeddings (N x D). '''
+        self.reset()
+        if self.numProto == 1:
+            self.update(x, y)
+            return self
+
+        # init with random members of each class, then Lloyd iterations
+        generator = torch.Generator().manual_seed(self.seed)
+        for c in range(self.numClass):
+            members = torch.nonzero(y == c).view(-1)
+            if members.numel() == 0:
+                continue
+            pick = torch.randint(members.numel(), (self.numProto,), generator=generator)
+            self.memory[c * self.numProto:(c + 1) * self.numProto] = x[members[pick.to(members.device)]]
+
+        proto = None
+        for _ in range(iters):
+            self.reset()
+            new_proto = self.update(x, y)
+            if proto is not None and torch.equal(proto, new_proto):
+                break
+            proto = new_proto
+        return self
+
+    def forward(self, x):
+        ''' Returns class scores (B x numClass): best prototype per class. '''
+        sim = torch.mm(x, self.memory.t())
+        sim = sim.masked_fill(self.counts.view(1, -1) == 0, float('-inf'))
+        return sim.view(x.size(0), self.numClass, self.numProto).max(2)[0]
@@ -0,0 +1,160 @@
+"""RandomResizedCrop, RandomGrayscale, ColorJitter and RandomHorizontalFlip
+applied to a whole batch of images at once with torch ops, each sample with
+its own random parameters (and its own jitter order, as torchvision draws
+one per call). Crop, resize and flip are one affine grid_sample; the colour
+ops follow torchvision's tensor definitions."""
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+def rgb_to_grayscale(x):
+    return (0.299 * x[:, 0] + 0.587 * x[:, 1] + 0.114 * x[:, 2]).unsqueeze(1)
+
+
+def rgb_to_hsv(x):
+    r, g, b = x.unbind(1)
+    maxc, _ = x.max(1)
+    minc, _ = x.min(1)
+    delta = maxc - minc
+    s = delta / maxc.clamp(min=1e-8)
+    deltac = delta.clamp(min=1e-8)
+    rc, gc, bc = (maxc - r) / deltac, (maxc - g) / deltac, (maxc - b) / deltac
+    h = torch.where(maxc == r, bc - gc, torch.where(maxc == g, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = torch.where(delta > 0, (h / 6.0) % 1.0, torch.zeros_like(h))
+    return torch.stack([h, s, maxc], 1)
+
+
+def hsv_to_rgb(x):
+    h, s, v = x.unbind(1)
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = (i.long() % 6).unsqueeze(1)
+    p, q, t = v * (1 - s), v * (1 - s * f), v * (1 - s * (1 - f))
+    r = torch.stack([v, q, p, p, t, v], 1).gather(1, i)
+    g = torch.stack([t, v, v, q, p, p], 1).gather(1, i)
+    b = torch.stack([p, p, t, v, v, q], 1).gather(1, i)
+    return torch.cat([r, g, b], 1)
+
+
+def adjust_brightness(x, factor):
+    return (x * factor.view(-1, 1, 1, 1)).clamp_(0, 1)
+
+
+def adjust_contrast(x, factor):
+    mean = rgb_to_grayscale(x).mean((1, 2, 3), keepdim=True)
+    return (mean + factor.view(-1, 1, 1, 1) * (x - mean)).clamp_(0, 1)
+
+
+def adjust_saturation(x, factor):
+    gray = rgb_to_grayscale(x)
+    return (gray + factor.view(-1, 1, 1, 1) * (x - gray)).clamp_(0, 1)
+
+
+def adjust_hue(x, factor):
+    hsv = rgb_to_hsv(x)
+    hsv[:, 0] = (hsv[:, 0] + factor.view(-1, 1, 1)) % 1.0
+    return hsv_to_rgb(hsv)
+
+
+class BatchAugment(object):
+    """uint8 RGB images N x 3 x H x W (on any device) to normalised float
+    views N x 3 x size x size."""
+
+    def __init__(self, size=224, scale=(0.2, 1.), ratio=(3. / 4., 4. / 3.), grayscale=0.2,
+                 jitter=(0.4, 0.4, 0.4, 0.4), flip=0.5,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.grayscale = grayscale
+        self.jitter = jitter
+        self.flip = flip
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(std).view(1, 3, 1, 1)
+
+    def crop_params(self, n, height, width, device, attempts=10):
+        """(top, left, h, w) per sample with torchvision's sampling: the first
+        of `attempts` draws that fits, else a central crop."""
+        area = height * width * torch.empty(n, attempts, device=device).uniform_(*self.scale)
+        log_ratio = torch.empty(n, attempts, device=device).uniform_(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect = torch.exp(log_ratio)
+        w = torch.sqrt(area * aspect).round()
+        h = torch.sqrt(area / aspect).round()
+        fits = (w > 0) & (w <= width) & (h > 0) & (h <= height)
+        first = fits.float().argmax(1, keepdim=True)
+        w, h = w.gather(1, first).squeeze(1), h.gather(1, first).squeeze(1)
+
+        in_ratio = float(width) / height
+        if in_ratio < min(self.ratio):
+            fw, fh = width, int(round(width / min(self.ratio)))
+        elif in_ratio > max(self.ratio):
+            fw, fh = int(round(height * max(self.ratio))), height
+        else:
+            fw, fh = width, height
+        ok = fits.any(1)
+        w = torch.where(ok, w, torch.full_like(w, fw))
+        h = torch.where(ok, h, torch.full_like(h, fh))
+        top = torch.where(ok, torch.floor(torch.rand(n, device=device) * (height - h + 1)), (height - h) // 2)
+        left = torch.where(ok, torch.floor(torch.rand(n, device=device) * (width - w + 1)), (width - w) // 2)
+        return top, left, h, w
+
+    def crop(self, images):
+        n, _, height, width = images.shape
+        top, left, h, w = self.crop_params(n, height, width, images.device)
+        flip = torch.where(torch.rand(n, device=images.device) < self.flip, -1.0, 1.0)
+
+        theta = torch.zeros(n, 2, 3, device=images.device)
+        theta[:, 0, 0] = w / width * flip
+        theta[:, 0, 2] = (2 * left + w) / width - 1
+        theta[:, 1, 1] = h / height
+        theta[:, 1, 2] = (2 * top + h) / height - 1
+        grid = F.affine_grid(theta, (n, 3, self.size, self.size), align_corners=False)
+        return F.grid_sample(images.float().div_(255), grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+    def color(self, x):
+        n = x.size(0)
+        gray = torch.rand(n, device=x.device) < self.grayscale
+        if gray.any():
+            x[gray] = rgb_to_grayscale(x[gray]).expand(-1, 3, -1, -1)
+
+        ops = []
+        for value, op, center in zip(self.jitter, [adjust_brightness, adjust_contrast, adjust_saturation, adjust_hue], [1, 1, 1, 0]):
+            if value:
+                low = max(0, center - value) if center else -value
+                ops.append((op, torch.empty(n, device=x.device).uniform_(low, center + value)))
+        if not ops:
+            return x
+        order = torch.rand(n, len(ops), device=x.device).argsort(1)
+        for slot in range(len(ops)):
+            for k, (op, factor) in enumerate(ops):
+                mask = order[:, slot] == k
+                if mask.any():
+                    x[mask] = op(x[mask], factor[mask])
+        return x
+
+    def __call__(self, images):
+        x = self.color(self.crop(images))
+        return (x - self.mean.to(x.device)) / self.std.to(x.device)
+
+
+class Uint8Normalize(object):
+    """uint8 CxHxW batches as the loader workers collate them (a tensor or a
+    list of views) to normalised float on device, one fused pass per view.
+    Tensors that are already float pass through."""
+
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), device="cuda"):
+        self.device = device
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(std).view(1, 3, 1, 1) * 255
+
+    def __call__(self, input):
+        if isinstance(input, (list, tuple)):
+            return [self(x) for x in input]
+        if input.dtype != torch.uint8:
+            return input
+        x = input.to(self.device, non_blocking=True).float()
+        if self.mean.device != x.device:
+            self.mean, self.std = self.mean.to(x.device), self.std.to(x.device)
+        return x.sub_(self.mean).div_(self.std)
@@ -0,0 +1,56 @@
+import torch
+from torch.utils.data import get_worker_info
+from torch.utils.data.dataloader import default_collate
+
+
+def view_rows(layout, views, batch_size):
+    """Row of view v of sample b in the collated [views * B, ...] tensor, as
+    a views x B table.
+    cat: torch.cat(views, 0), what BatchCriterion and the rotation branch use.
+    interleave: the first and second half of the views stacked per row, what
+    the synthesis / domain branches build with torch.stack(..., dim=1)
+    (BatchCriterionFour)."""
+    v = torch.arange(views).view(-1, 1)
+    b = torch.arange(batch_size).view(1, -1)
+    if layout == "cat":
+        return v * batch_size + b
+    if layout == "interleave":
+        half = views // 2
+        return 2 * ((v % half) * batch_size + b) + v // half
+    raise ValueError("unknown view layout %s" % layout)
+
+
+class ViewCollate(object):
+    """Collates (views, target, index, name) samples by copying every view
+    straight into one [views * B, C, H, W] tensor (in shared memory inside a
+    DataLoader worker) in the given layout; the other fields are collated as
+    usual. Samples without a list of views fall back to default_collate."""
+
+    def __init__(self, layout="cat"):
+        self.layout = layout
+
+    def __call__(self, batch):
+        views = batch[0][0]
+        if not isinstance(views, (list, tuple)):
+            return default_collate(batch)
+
+        elem = views[0]
+        rows = view_rows(self.layout, len(views), len(batch)).tolist()
+        shape = (len(views) * len(batch),) + tuple(elem.shape)
+        if get_worker_info() is not None:
+            # shared memory, so the batch is not copied again on its way to the main process
+            out = torch.empty(shape, dtype=elem.dtype).share_memory_()
+        else:
+            out = elem.new_empty(shape)
+        for b, sample in enumerate(batch):
+            for v, view in enumerate(sample[0]):
+                out[rows[v][b]].copy_(view)
+
+        rest = default_collate([sample[1:] for sample in batch])
+        return [out] + list(rest)
+
+
+def cat_views(input):
+    """The views of a batch as one tensor, concatenating only if they still
+    arrive as a list."""
+    return input if torch.is_tensor(input) else torch.cat(input, 0)
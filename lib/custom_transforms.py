@@ -8,6 +8,8 @@ from PIL import Image
 import numbers
 import random
 
+from lib.seeding import integers, rng
+
 __author__ = "Wei OUYANG"
 __license__ = "GPL"
 __version__ = "0.1.0"
@@ -27,7 +29,14 @@ def to_tensor(x):
     return torch.from_numpy(x).float()
 
 
-def random_num_generator(config, random_state=np.random):
+def _state(random_state):
+    """random_state if one was given, else the generator of the sample
+    being loaded (lib.seeding.rng)."""
+    return rng() if random_state is None else random_state
+
+
+def random_num_generator(config, random_state=None):
+    random_state = _state(random_state)
     if config[0] == 'uniform':
         ret = random_state.uniform(config[1], config[2], 1)[0]
     elif config[0] == 'lognormal':
@@ -38,7 +47,8 @@ def random_num_generator(config, random_state=np.random):
     return ret
 
 
-def poisson_downsampling(image, peak, random_state=np.random):
+def poisson_downsampling(image, peak, random_state=None):
+    random_state = _state(random_state)
     if not isinstance(image, np.ndarray):
         imgArr = np.array(image, dtype='float32')
     else:
@@ -51,7 +61,7 @@ def poisson_downsampling(image, peak, random_state=np.random):
     return noisy_img.astype('float32')
 
 
-def elastic_transform(image, alpha=1000, sigma=30, spline_order=1, mode='nearest', random_state=np.random):
+def elastic_transform(image, alpha=1000, sigma=30, spline_order=1, mode='nearest', random_state=None):
     """Elastic deformation of image as described in [Simard2003]_.
     .. [Simard2003] Simard, Steinkraus and Platt, "Best Practices for
        Convolutional Neural Networks applied to Visual Document Analysis", in
@@ -59,11 +69,12 @@ def elastic_transform(image, alpha=1000, sigma=30, spline_order=1, mode='nearest
        Recognition, 2003.
     """
     assert image.ndim == 3
+    random_state = _state(random_state)
     shape = image.shape[:2]
 
-    dx = gaussian_filter((random_state.rand(*shape) * 2 - 1),
+    dx = gaussian_filter((random_state.random(shape) * 2 - 1),
                          sigma, mode="constant", cval=0) * alpha
-    dy = gaussian_filter((random_state.rand(*shape) * 2 - 1),
+    dy = gaussian_filter((random_state.random(shape) * 2 - 1),
                          sigma, mode="constant", cval=0) * alpha
 
     x, y = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
@@ -149,24 +160,24 @@ class PoissonSubsampling(object):
     """Poisson subsampling on a numpy.ndarray (H x W x C)
     """
 
-    def __init__(self, peak, random_state=np.random):
+    def __init__(self, peak, random_state=None):
         self.peak = peak
         self.random_state = random_state
 
     def __call__(self, image):
         if isinstance(self.peak, collections.Sequence):
             peak = random_num_generator(
-                self.peak, random_state=self.random_state)
+                self.peak, random_state=_state(self.random_state))
         else:
             peak = self.peak
-        return poisson_downsampling(image, peak, random_state=self.random_state)
+        return poisson_downsampling(image, peak, random_state=_state(self.random_state))
 
 
 class AddGaussianNoise(object):
     """Add gaussian noise to a numpy.ndarray (H x W x C)
     """
 
-    def __init__(self, mean, sigma, random_state=np.random):
+    def __init__(self, mean, sigma, random_state=None):
         self.sigma = sigma
         self.mean = mean
         self.random_state = random_state
@@ -174,15 +185,15 @@ class AddGaussianNoise(object):
     def __call__(self, image):
         if isinstance(self.sigma, collections.Sequence):
             sigma = random_num_generator(
-                self.sigma, random_state=self.random_state)
+                self.sigma, random_state=_state(self.random_state))
         else:
             sigma = self.sigma
-        if isinstance(self.mean, collections.Sequence, random_state=self.random_state):
-            mean = random_num_generator(self.mean)
+        if isinstance(self.mean, collections.Sequence):
+            mean = random_num_generator(self.mean, random_state=_state(self.random_state))
         else:
             mean = self.mean
         row, col, ch = image.shape
-        gauss = self.random_state.normal(mean, sigma, (row, col, ch))
+        gauss = _state(self.random_state).normal(mean, sigma, (row, col, ch))
         gauss = gauss.reshape(row, col, ch)
         image += gauss
         return image
@@ -192,7 +203,7 @@ class AddSpeckleNoise(object):
     """Add speckle noise to a numpy.ndarray (H x W x C)
     """
 
-    def __init__(self, mean, sigma, random_state=np.random):
+    def __init__(self, mean, sigma, random_state=None):
         self.sigma = sigma
         self.mean = mean
         self.random_state = random_state
@@ -200,16 +211,16 @@ class AddSpeckleNoise(object):
     def __call__(self, image):
         if isinstance(self.sigma, collections.Sequence):
             sigma = random_num_generator(
-                self.sigma, random_state=self.random_state)
+                self.sigma, random_state=_state(self.random_state))
         else:
             sigma = self.sigma
         if isinstance(self.mean, collections.Sequence):
             mean = random_num_generator(
-                self.mean, random_state=self.random_state)
+                self.mean, random_state=_state(self.random_state))
         else:
             mean = self.mean
         row, col, ch = image.shape
-        gauss = self.random_state.normal(mean, sigma, (row, col, ch))
+        gauss = _state(self.random_state).normal(mean, sigma, (row, col, ch))
         gauss = gauss.reshape(row, col, ch)
         image += image * gauss
         return image
@@ -219,7 +230,7 @@ class RandomGaussianBlurring(object):
     """Apply gaussian blur to a numpy.ndarray (H x W x C)
     """
 
-    def __init__(self, sigma, p=0.2, random_state=np.random):
+    def __init__(self, sigma, p=0.2, random_state=None):
         self.sigma = sigma
         self.p = p
         self.random_state = random_state
@@ -227,10 +238,10 @@ class RandomGaussianBlurring(object):
     def __call__(self, image):
         if isinstance(self.sigma, collections.Sequence):
             sigma = random_num_generator(
-                self.sigma, random_state=self.random_state)
+                self.sigma, random_state=_state(self.random_state))
         else:
             sigma = self.sigma
-        if random.random() < self.p:
+        if _state(self.random_state).random() < self.p:
             image = gaussian_filter(image, sigma=(sigma, sigma, 0))
         return image
 
@@ -239,7 +250,7 @@ class AddGaussianPoissonNoise(object):
     """Add poisson noise with gaussian blurred image to a numpy.ndarray (H x W x C)
     """
 
-    def __init__(self, sigma, peak, random_state=np.random):
+    def __init__(self, sigma, peak, random_state=None):
         self.sigma = sigma
         self.peak = peak
         self.random_state = random_state
@@ -247,17 +258,17 @@ class AddGaussianPoissonNoise(object):
     def __call__(self, image):
         if isinstance(self.sigma, collections.Sequence):
             sigma = random_num_generator(
-                self.sigma, random_state=self.random_state)
+                self.sigma, random_state=_state(self.random_state))
         else:
             sigma = self.sigma
         if isinstance(self.peak, collections.Sequence):
             peak = random_num_generator(
-                self.peak, random_state=self.random_state)
+                self.peak, random_state=_state(self.random_state))
         else:
             peak = self.peak
         bg = gaussian_filter(image, sigma=(sigma, sigma, 0))
         bg = poisson_downsampling(
-            bg, peak=peak, random_state=self.random_state)
+            bg, peak=peak, random_state=_state(self.random_state))
         return image + bg
 
 
@@ -322,7 +333,7 @@ class RandomCropNumpy(object):
     or an integer, in which case the target will be of a square shape (size, size)
     """
 
-    def __init__(self, size, random_state=np.random):
+    def __init__(self, size, random_state=None):
         if isinstance(size, numbers.Number):
             self.size = (int(size), int(size))
         else:
@@ -335,8 +346,8 @@ class RandomCropNumpy(object):
         if w == tw and h == th:
             return img
 
-        x1 = self.random_state.randint(0, w - tw)
-        y1 = self.random_state.randint(0, h - th)
+        x1 = integers(_state(self.random_state), 0, w - tw)
+        y1 = integers(_state(self.random_state), 0, h - th)
         return img[x1:x1 + tw, y1: y1 + th, :]
 
 
@@ -364,7 +375,7 @@ class RandomRotate(object):
     """Rotate a PIL.Image or numpy.ndarray (H x W x C) randomly
     """
 
-    def __init__(self, angle_range=(0.0, 360.0), axes=(0, 1), mode='reflect', random_state=np.random):
+    def __init__(self, angle_range=(0.0, 360.0), axes=(0, 1), mode='reflect', random_state=None):
         assert isinstance(angle_range, tuple)
         self.angle_range = angle_range
         self.random_state = random_state
@@ -372,7 +383,7 @@ class RandomRotate(object):
         self.mode = mode
 
     def __call__(self, image):
-        angle = self.random_state.uniform(
+        angle = _state(self.random_state).uniform(
             self.angle_range[0], self.angle_range[1])
         if isinstance(image, np.ndarray):
             mi, ma = image.min(), image.max()
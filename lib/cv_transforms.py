@@ -0,0 +1,207 @@
+"""torchvision-style augmentations on uint8 numpy images as cv2 decodes them.
+
+Inputs are HxWx3 BGR arrays straight from cv2.imread; every op works in BGR
+(grayscale and hue use the BGR conversions) and ToTensor emits RGB, so the
+ImageNet statistics in Normalize see the channel order they were computed
+for. Random parameters follow torchvision's sampling and are drawn from
+lib.seeding.rng(). The class names mirror torchvision.transforms so a
+trainer can pick a backend with
+
+    T = cv_transforms if args.aug_backend == 'cv2' else transforms
+
+Benchmark against the PIL pipeline, in samples per second of one worker:
+
+    python -m lib.cv_transforms ./data/Training400/resized_image_320 --views 2
+"""
+import math
+import numbers
+
+import cv2
+import numpy as np
+import torch
+from torchvision.transforms import Compose, Normalize
+
+from lib.seeding import integers, rng
+
+
+def _resize(img, width, height):
+    interpolation = cv2.INTER_AREA if width * height < img.shape[0] * img.shape[1] else cv2.INTER_LINEAR
+    return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+class Resize(object):
+    """int: shorter side to size keeping the aspect ratio; (h, w): exact."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, img):
+        h, w = img.shape[:2]
+        if isinstance(self.size, numbers.Number):
+            if h <= w:
+                return _resize(img, int(self.size * w / h), self.size)
+            return _resize(img, self.size, int(self.size * h / w))
+        return _resize(img, self.size[1], self.size[0])
+
+
+class RandomResizedCrop(object):
+
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.)):
+        self.size = (size, size) if isinstance(size, numbers.Number) else tuple(size)
+        self.scale = scale
+        self.ratio = ratio
+
+    def get_params(self, height, width):
+        generator = rng()
+        area = height * width
+        log_ratio = (math.log(self.ratio[0]), math.log(self.ratio[1]))
+        for _ in range(10):
+            target_area = area * generator.uniform(*self.scale)
+            aspect_ratio = math.exp(generator.uniform(*log_ratio))
+            w = int(round(math.sqrt(target_area * aspect_ratio)))
+            h = int(round(math.sqrt(target_area / aspect_ratio)))
+            if 0 < w <= width and 0 < h <= height:
+                return integers(generator, 0, height - h + 1), integers(generator, 0, width - w + 1), h, w
+
+        # fall back to a central crop
+        in_ratio = float(width) / float(height)
+        if in_ratio < min(self.ratio):
+            w = width
+            h = int(round(w / min(self.ratio)))
+        elif in_ratio > max(self.ratio):
+            h = height
+            w = int(round(h * max(self.ratio)))
+        else:
+            w, h = width, height
+        return (height - h) // 2, (width - w) // 2, h, w
+
+    def __call__(self, img):
+        i, j, h, w = self.get_params(*img.shape[:2])
+        return _resize(img[i:i + h, j:j + w], self.size[1], self.size[0])
+
+
+class RandomHorizontalFlip(object):
+
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, img):
+        return cv2.flip(img, 1) if rng().random() < self.p else img
+
+
+def to_grayscale(img):
+    return cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+
+
+class RandomGrayscale(object):
+
+    def __init__(self, p=0.1):
+        self.p = p
+
+    def __call__(self, img):
+        return to_grayscale(img) if rng().random() < self.p else img
+
+
+def _lut(img, table):
+    return cv2.LUT(img, np.clip(table, 0, 255).astype(np.uint8))
+
+
+def adjust_brightness(img, factor):
+    return _lut(img, np.arange(256) * factor)
+
+
+def adjust_contrast(img, factor):
+    mean = int(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).mean() + 0.5)
+    return _lut(img, mean + factor * (np.arange(256) - mean))
+
+
+def adjust_saturation(img, factor):
+    return cv2.addWeighted(img, factor, to_grayscale(img), 1 - factor, 0)
+
+
+def adjust_hue(img, factor):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV_FULL)
+    # hue is 0..255 here and wraps around like PIL's
+    hsv[..., 0] += np.uint8(int(factor * 255) % 256)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR_FULL)
+
+
+class ColorJitter(object):
+
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0):
+        self.brightness = self._range(brightness, 1)
+        self.contrast = self._range(contrast, 1)
+        self.saturation = self._range(saturation, 1)
+        self.hue = self._range(hue, 0)
+
+    @staticmethod
+    def _range(value, center):
+        if not value:
+            return None
+        return (max(0, center - value), center + value) if center else (-value, value)
+
+    def __call__(self, img):
+        ops = [(self.brightness, adjust_brightness), (self.contrast, adjust_contrast),
+               (self.saturation, adjust_saturation), (self.hue, adjust_hue)]
+        generator = rng()
+        for k in generator.permutation(len(ops)):
+            bounds, op = ops[k]
+            if bounds is not None:
+                img = op(img, generator.uniform(*bounds))
+        return img
+
+
+class ToTensor(object):
+    """BGR uint8 HxWx3 to an RGB float CxHxW tensor in [0, 1]."""
+
+    def __call__(self, img):
+        return torch.from_numpy(np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))).float().div_(255)
+
+
+class ToUint8Tensor(object):
+    """BGR uint8 HxWx3 to an RGB uint8 CxHxW tensor, normalised later per
+    batch (lib.batch_augment.Uint8Normalize)."""
+
+    def __call__(self, img):
+        return torch.from_numpy(np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1)))
+
+
+def benchmark(folder, n=256, views=2, size=224):
+    import glob
+    import time
+    import torchvision.transforms as transforms
+    from PIL import Image
+    import lib.cv_transforms as cv_transforms
+
+    paths = sorted(glob.glob(folder + "/*.jpg") + glob.glob(folder + "/*.png"))[:n]
+    images = [cv2.imread(path) for path in paths]
+    normalize = Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    for title, T, convert in [("pil", transforms, lambda x: Image.fromarray(np.uint8(x))),
+                              ("cv2", cv_transforms, lambda x: x)]:
+        aug = T.Compose([T.RandomResizedCrop(size, scale=(0.2, 1.)),
+                         T.RandomGrayscale(p=0.2),
+                         T.ColorJitter(0.4, 0.4, 0.4, 0.4),
+                         T.RandomHorizontalFlip(),
+                         T.ToTensor(),
+                         normalize])
+        start = time.time()
+        for image in images:
+            sample = convert(image)
+            for _ in range(views):
+                aug(sample)
+        elapsed = time.time() - start
+        print("%s: %d samples x %d views in %.2fs, %.1f samples/s per worker" % (title, len(images), views, elapsed, len(images) / elapsed))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='PIL vs cv2 augmentation throughput')
+    parser.add_argument('folder', help='directory of resized images')
+    parser.add_argument('--n', default=256, type=int, help='number of images')
+    parser.add_argument('--views', default=2, type=int, help='augmented views per sample (2 multiaug, 4 synthesis)')
+    parser.add_argument('--size', default=224, type=int)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    cv2.setNumThreads(1)
+    benchmark(args.folder, args.n, args.views, args.size)
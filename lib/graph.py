@@ -0,0 +1,70 @@
+import math
+import warnings
+
+import torch
+
+
+def blocked_topk(query, keys, K, block=1024, exclude_self=False):
+    """Top-K inner products of every query row against keys (both N x D),
+    computed block by block so only block x M similarities are alive at once.
+    Returns (values, indices), each len(query) x K."""
+    values, indices = [], []
+    for start in range(0, query.size(0), block):
+        sim = torch.mm(query[start:start + block], keys.t())
+        if exclude_self:
+            rows = torch.arange(sim.size(0), device=sim.device)
+            sim[rows, rows + start] = -float('inf')
+        yd, yi = sim.topk(K, dim=1, largest=True, sorted=True)
+        values.append(yd)
+        indices.append(yi)
+    return torch.cat(values, 0), torch.cat(indices, 0)
+
+
+def knn_graph(features, K, gamma=3, block=1024):
+    """Symmetric sparse affinity W = A + A^T, A_ij = max(s_ij, 0)^gamma over
+    the K nearest neighbours, returned as D^-1/2 W D^-1/2 (sparse N x N)."""
+    N = features.size(0)
+    yd, yi = blocked_topk(features, features, K, block=block, exclude_self=True)
+
+    rows = torch.arange(N, device=features.device).view(-1, 1).expand(-1, K).reshape(-1)
+    cols = yi.reshape(-1)
+    vals = yd.reshape(-1).clamp(min=0).pow(gamma)
+
+    W = torch.sparse_coo_tensor(torch.stack([torch.cat([rows, cols]), torch.cat([cols, rows])]),
+                                torch.cat([vals, vals]), (N, N)).coalesce()
+    index, vals = W.indices(), W.values()
+
+    degree = torch.zeros(N, device=features.device).index_add_(0, index[0], vals)
+    d_inv_sqrt = degree.clamp(min=1e-12).pow(-0.5)
+    vals = vals * d_inv_sqrt[index[0]] * d_inv_sqrt[index[1]]
+    return torch.sparse_coo_tensor(index, vals, (N, N)).coalesce()
+
+
+def label_propagation(S, labels, labeled, C, alpha=0.99, max_iter=None, tol=1e-6):
+    """Iterates F <- alpha * S F + Y (Zhou et al.) until the update, relative
+    to max |F|, is below tol. The error shrinks by about alpha per step, so
+    max_iter defaults to log(tol) / log(alpha) (1375 steps for 0.99, 1e-6)
+    plus a margin; a warning is issued if it is reached first.
+    labels/labeled are N-vectors; unlabeled rows of Y are zero.
+    Returns row-normalised class scores N x C."""
+    N = S.size(0)
+    Y = torch.zeros(N, C, device=labels.device)
+    Y[labeled, labels[labeled]] = 1
+    if max_iter is None:
+        max_iter = int(math.ceil(math.log(tol) / math.log(alpha))) + 10
+
+    F = Y.clone()
+    converged = False
+    for it in range(max_iter):
+        F_new = alpha * torch.sparse.mm(S, F) + Y
+        delta = (F_new - F).abs().max().item() / F_new.abs().max().clamp(min=1e-12).item()
+        F = F_new
+        if delta < tol:
+            converged = True
+            break
+    if not converged:
+        warnings.warn("label propagation stopped after %d iterations at a relative update of %.2g (tol %.2g)"
+                      % (max_iter, delta, tol))
+
+    F = F.clamp(min=0)
+    return F / F.sum(1, keepdim=True).clamp(min=1e-12)
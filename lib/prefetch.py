@@ -0,0 +1,174 @@
+import queue
+import threading
+import time
+
+import torch
+
+from lib.collate import cat_views
+
+
+def rotate(x, r):
+    """x rotated by r * 90 degrees."""
+    if r == 1:
+        return torch.flip(torch.transpose(x, 2, 3), [2])
+    if r == 2:
+        return torch.flip(torch.flip(x, [2]), [3])
+    if r == 3:
+        return torch.transpose(torch.flip(x, [2]), 2, 3)
+    return x
+
+
+class RotationBatch(object):
+    """A rotation batch ready for the model: k rotations of every input
+    (rows b*k + j), or only the upright inputs for models that rotate in
+    their stem, with the rotation labels and repeated indices."""
+
+    def __init__(self, data, labels, index, n):
+        self.data = data
+        self.labels = labels
+        self.index = index
+        self.n = n
+
+    def size(self, dim=0):
+        # number of inputs before rotation, as the loss meters count them
+        return self.n
+
+
+def build_rotation_batch(input, index, rotation_label, out=None, rotate_input=True, k=4):
+    """input 2B x C x H x W -> its rotations stacked per sample into out (or
+    a new tensor), their labels and the indices repeated k times. k=4 gives
+    0/90/180/270 degrees with labels [rotation_label, 1, 2, 3]; k=1 or 2
+    draws k distinct rotations per input. rotate_input=False keeps input as
+    it is (--rotstem)."""
+    n = input.size(0)
+    if k == 4:
+        labels = torch.stack([rotation_label, torch.ones_like(rotation_label),
+                              2 * torch.ones_like(rotation_label), 3 * torch.ones_like(rotation_label)], dim=1).view(-1)
+    else:
+        rotations = torch.rand(n, 4, device=input.device).argsort(1)[:, :k]
+        labels = rotations.reshape(-1)
+    index = index.view(-1, 1).expand(n, k).reshape(-1)
+    if not rotate_input:
+        return RotationBatch(input, labels, index, n)
+
+    if out is None:
+        out = input.new_empty((n * k,) + tuple(input.shape[1:]))
+    rotated = out.view((n, k) + tuple(input.shape[1:]))
+    if k == 4:
+        for r in range(4):
+            rotated[:, r].copy_(rotate(input, r))
+    else:
+        for j in range(k):
+            for r in range(4):
+                rows = (rotations[:, j] == r).nonzero()[:, 0]
+                if len(rows):
+                    rotated[rows, j] = rotate(input[rows], r)
+    return RotationBatch(out, labels, index, n)
+
+
+class RotationPrefetcher(object):
+    """Iterates (RotationBatch, target, index, name) over a loader while a
+    background thread already moves the next batch to the GPU (on its own
+    stream), normalises it and builds its rotations into one of two
+    preallocated buffers. A buffer is handed back to the thread once the
+    step that used it has been queued, guarded by a CUDA event.
+    stats() reports the assembly time spent in the thread and how much of
+    it the training loop still waited for (per batch, at most its own wait
+    for that batch, the rest being loader time)."""
+
+    def __init__(self, loader, normalize=None, device="cuda", buffers=2, rotate_input=True, k=4):
+        self.loader = loader
+        self.normalize = normalize
+        self.rotate_input = rotate_input
+        self.k = k
+        self.device = torch.device(device)
+        self.cuda = self.device.type == "cuda"
+        self.stream = torch.cuda.Stream(device=self.device) if self.cuda else None
+        self.buffers = [None] * buffers
+        self.released = [None] * buffers
+        self.free = queue.Queue()
+        for slot in range(buffers):
+            self.free.put(slot)
+        self.ready = queue.Queue(maxsize=buffers)
+        self.current = None
+        self.assembly = 0.
+        self.wait = 0.
+        self.exposed = 0.
+        self.batches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        return self
+
+    def _assemble(self, slot, input, target, index):
+        input = cat_views(self.normalize(input) if self.normalize is not None else input)
+        input = input.to(self.device, non_blocking=True)
+        index = torch.cat([index, index], 0).to(self.device, non_blocking=True)
+        rotation_label = torch.cat([target[1], target[1]], 0).to(self.device, non_blocking=True)
+        if not self.rotate_input:
+            return build_rotation_batch(input, index, rotation_label, rotate_input=False)
+
+        shape = (input.size(0) * self.k,) + tuple(input.shape[1:])
+        buffer = self.buffers[slot]
+        if buffer is None or tuple(buffer.shape) != shape or buffer.dtype != input.dtype:
+            buffer = self.buffers[slot] = input.new_empty(shape)
+        return build_rotation_batch(input, index, rotation_label, out=buffer, k=self.k)
+
+    def _run(self):
+        try:
+            for input, target, index, name in self.loader:
+                slot = self.free.get()
+                start = time.time()
+                if self.cuda:
+                    with torch.cuda.stream(self.stream):
+                        if self.released[slot] is not None:
+                            self.stream.wait_event(self.released[slot])
+                        batch = self._assemble(slot, input, target, index)
+                        done = torch.cuda.Event()
+                        done.record(self.stream)
+                    done.synchronize()
+                else:
+                    done = None
+                    batch = self._assemble(slot, input, target, index)
+                self.ready.put((slot, done, time.time() - start, batch, target, index, name))
+        except Exception as error:
+            self.ready.put(error)
+            return
+        self.ready.put(None)
+
+    def __next__(self):
+        if self.current is not None:
+            # the previous step has been queued; its buffer is free once it ran
+            if self.cuda:
+                self.released[self.current] = torch.cuda.Event()
+                self.released[self.current].record(torch.cuda.current_stream(self.device))
+            self.free.put(self.current)
+            self.current = None
+
+        start = time.time()
+        item = self.ready.get()
+        wait = time.time() - start
+        if item is None:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        slot, done, assembly, batch, target, index, name = item
+        self.assembly += assembly
+        self.wait += wait
+        self.exposed += min(wait, assembly)
+        if done is not None:
+            torch.cuda.current_stream(self.device).wait_event(done)
+        self.current = slot
+        self.batches += 1
+        return batch, target, index, name
+
+    next = __next__
+
+    def stats(self):
+        hidden = self.assembly - self.exposed
+        return {"batches": self.batches, "assembly": self.assembly, "wait": self.wait, "hidden": hidden,
+                "hidden_pct": 100. * hidden / self.assembly if self.assembly else 0.}
@@ -0,0 +1,263 @@
+import itertools
+import time
+
+import numpy as np
+import torch
+import torch.utils.data as data
+
+from lib.seeding import SeededIndex
+
+
+def permutation(n, shuffle, seed, epoch):
+    if not shuffle:
+        return torch.arange(n)
+    generator = torch.Generator()
+    generator.manual_seed(seed + epoch)
+    return torch.randperm(n, generator=generator)
+
+
+class EpochSampler(data.Sampler):
+    """One pass over 0..n-1 per epoch (shuffled from seed + epoch), yielding
+    SeededIndex so datasets.seeded.SeededDataset can key augmentations by
+    epoch. Call set_epoch before iterating, as with DistributedSampler."""
+
+    def __init__(self, n, shuffle=False, seed=0):
+        self.n = n
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        epoch = self.epoch
+        for i in permutation(self.n, self.shuffle, self.seed, epoch).tolist():
+            yield SeededIndex(i, epoch)
+
+
+class LocalitySampler(data.Sampler):
+    """A shuffled epoch that still reads the disk in runs: the indices are
+    sorted by keys (e.g. inode numbers, which on most filesystems follow
+    allocation order) and cut into chunks of `chunk` neighbours; every
+    epoch shuffles the order of the chunks and the indices within each
+    chunk (from seed + epoch). Yields SeededIndex like EpochSampler; call
+    set_epoch before iterating."""
+
+    def __init__(self, keys, chunk=2048, seed=0):
+        self.order = torch.from_numpy(np.argsort(np.asarray(keys), kind="stable"))
+        self.chunk = max(1, chunk)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        epoch = self.epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        chunks = torch.split(self.order, self.chunk)
+        for c in torch.randperm(len(chunks), generator=generator).tolist():
+            members = chunks[c]
+            for i in members[torch.randperm(len(members), generator=generator)].tolist():
+                yield SeededIndex(i, epoch)
+
+
+class InfiniteSampler(data.Sampler):
+    """Indices 0..n-1 pass after pass, never stopping, so one DataLoader
+    iterator (and its workers) lives for the whole run. With shuffle, pass p
+    is the permutation drawn from seed + p, so the stream is the same in
+    every run; start skips the first start indices, e.g. step * batch_size
+    when resuming. Indices carry their pass as the epoch."""
+
+    def __init__(self, n, shuffle=False, seed=0, start=0):
+        self.n = n
+        self.shuffle = shuffle
+        self.seed = seed
+        self.start = start
+
+    def __iter__(self):
+        p, offset = divmod(self.start, self.n)
+        for p in itertools.count(p):
+            for i in permutation(self.n, self.shuffle, self.seed, p)[offset:].tolist():
+                yield SeededIndex(i, p)
+            offset = 0
+
+
+def forever(loader):
+    """Batches of a finite loader, epoch after epoch."""
+    while True:
+        for batch in loader:
+            yield batch
+
+
+def kmeans(x, k, iters=10, generator=None):
+    """Spherical k-means of the L2-normalised rows of x (on x's device);
+    returns the cluster of every row. Empty clusters are reseeded with
+    random rows."""
+    n = x.size(0)
+    pick = torch.randperm(n, generator=generator)[:k].to(x.device)
+    centroids = x[pick]
+    for _ in range(iters):
+        assign = torch.mm(x, centroids.t()).argmax(1)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+        counts = torch.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            fill = torch.randint(n, (int(empty.sum()),), generator=generator).to(x.device)
+            sums[empty] = x[fill]
+        centroids = sums / sums.norm(dim=1, keepdim=True).clamp_min(1e-12)
+    return torch.mm(x, centroids.t()).argmax(1)
+
+
+class NeighbourBatchSampler(data.Sampler):
+    """Batches of exactly batch_size distinct indices, every index once per
+    epoch, where hard * batch_size of a batch come from one k-means cluster
+    of the memory bank (near neighbours, so hard negatives for the in-batch
+    losses) and the rest are random. Clusters are recomputed every `every`
+    epochs from self.memory, which has to be set before iterating (epoch 0,
+    before the bank means anything, is random). Yields SeededIndex like
+    EpochSampler; call set_epoch before iterating."""
+
+    def __init__(self, n, batch_size, hard=0.5, clusters=0, every=1, seed=0, memory=None):
+        self.n = n
+        self.batch_size = batch_size
+        self.hard = int(round(hard * batch_size))
+        self.clusters = clusters if clusters > 0 else max(1, n // batch_size)
+        self.every = every
+        self.seed = seed
+        self.memory = memory
+        self.assign = None
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.n // self.batch_size
+
+    def recluster(self, generator):
+        start = time.time()
+        with torch.no_grad():
+            self.assign = kmeans(self.memory[:self.n].float(), self.clusters, generator=generator).cpu()
+        sizes = torch.bincount(self.assign, minlength=self.clusters)
+        print("memory bank clustered into %d groups (largest %d, %d singletons) in %.2fs"
+              % (self.clusters, sizes.max(), (sizes == 1).sum(), time.time() - start))
+
+    def __iter__(self):
+        epoch = self.epoch
+        if self.memory is None and self.hard > 0:
+            raise RuntimeError("NeighbourBatchSampler has no memory bank to cluster, set its memory before iterating")
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        if self.hard > 0 and epoch > 0 and (self.assign is None or epoch % self.every == 0):
+            self.recluster(generator)
+
+        batches = len(self)
+        chunks = []
+        if self.assign is not None and self.hard > 0:
+            # every cluster, shuffled, cut into chunks of self.hard neighbours
+            order = torch.randperm(self.n, generator=generator)
+            order = order[torch.sort(self.assign[order], stable=True)[1]]
+            for members in torch.split(order, torch.bincount(self.assign, minlength=self.clusters).tolist()):
+                chunks += list(members[:len(members) // self.hard * self.hard].view(-1, self.hard))
+            chunks = [chunks[i] for i in torch.randperm(len(chunks), generator=generator)[:batches].tolist()]
+            used = torch.cat(chunks) if chunks else torch.zeros(0, dtype=torch.long)
+            # everything not in a chosen chunk fills the random part
+            mask = torch.ones(self.n, dtype=torch.bool)
+            mask[used] = False
+            rest = torch.arange(self.n)[mask]
+        else:
+            rest = torch.arange(self.n)
+        rest = rest[torch.randperm(len(rest), generator=generator)].tolist()
+
+        offset = 0
+        for b in range(batches):
+            batch = chunks[b].tolist() if b < len(chunks) else []
+            fill = self.batch_size - len(batch)
+            batch += rest[offset:offset + fill]
+            offset += fill
+            yield [SeededIndex(i, epoch) for i in batch]
+
+
+class MixtureSampler(data.Sampler):
+    """num_samples global indices per epoch over concatenated sources: the
+    source of every draw is picked with probability proportional to its
+    weight and each source walks through its own permutations, so a source
+    repeats only once all of its samples were drawn. Yields SeededIndex
+    like EpochSampler; call set_epoch before iterating."""
+
+    def __init__(self, sizes, weights, num_samples=0, seed=0):
+        self.sizes = list(sizes)
+        self.weights = torch.tensor(weights, dtype=torch.double)
+        self.offsets = [0] + list(itertools.accumulate(self.sizes))
+        self.num_samples = num_samples if num_samples > 0 else self.offsets[-1]
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        epoch = self.epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        source = torch.multinomial(self.weights, self.num_samples, replacement=True, generator=generator)
+        order = torch.empty(self.num_samples, dtype=torch.long)
+        for s, size in enumerate(self.sizes):
+            picks = (source == s).nonzero()[:, 0]
+            passes = -(-len(picks) // size) if size else 0
+            if passes:
+                local = torch.cat([torch.randperm(size, generator=generator) for _ in range(passes)])[:len(picks)]
+                order[picks] = local + self.offsets[s]
+        for i in order.tolist():
+            yield SeededIndex(i, epoch)
+
+
+class WorkerAffineBatchSampler(data.Sampler):
+    """Batches such that every sample is always loaded by the same
+    DataLoader worker: the indices are split once (from seed) into
+    num_workers fixed groups, every epoch shuffles each group into batches
+    and batch j is taken from group j % num_workers, the worker the
+    DataLoader hands batch j to. Per-worker caches then see the same
+    samples every epoch. Each group drops its last partial batch and all
+    groups give the same number of batches. Yields SeededIndex; call
+    set_epoch before iterating."""
+
+    def __init__(self, n, batch_size, num_workers, shuffle=True, seed=0):
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        order = torch.randperm(n, generator=generator) if shuffle else torch.arange(n)
+        self.groups = [order[w::self.num_workers] for w in range(self.num_workers)]
+        self.per_group = min(len(group) for group in self.groups) // batch_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.per_group * self.num_workers
+
+    def __iter__(self):
+        epoch = self.epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + 1 + epoch)
+        groups = [(group[torch.randperm(len(group), generator=generator)] if self.shuffle else group).tolist()
+                  for group in self.groups]
+        for b in range(self.per_group):
+            for group in groups:
+                yield [SeededIndex(i, epoch) for i in group[b * self.batch_size:(b + 1) * self.batch_size]]
@@ -0,0 +1,92 @@
+"""Augmentation randomness derived from (run, epoch, sample) instead of
+from whichever worker happens to load a sample, so a run draws the same
+augmentations with any num_workers or --fetch-threads.
+
+Samplers yield SeededIndex (an int carrying the epoch). While a sample is
+loaded inside sample_rng(run, epoch, index):
+  * rng() returns a numpy Generator of its own, which lib/cv_transforms.py
+    and lib/custom_transforms.py draw from (thread-local, so threaded
+    batch fetching stays reproducible);
+  * Python's random, numpy's global RandomState and torch's default CPU
+    generator are reseeded from the same SeedSequence for the torchvision
+    transforms (which draw crop and flip parameters from random or torch)
+    and the datasets' own np.random calls. These are process-global, so
+    only the cv2 backend is reproducible when samples are fetched with
+    threads.
+worker_init(run) seeds random, numpy and torch per (run, worker, loader
+base seed) for everything outside a sample; the base seed is drawn anew
+each time the DataLoader starts its workers, so epochs still differ.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+_SAMPLE, _WORKER = 0, 1
+_local = threading.local()
+
+
+class SeededIndex(int):
+    """A dataset index that also carries the epoch it was drawn for."""
+
+    def __new__(cls, value, epoch=0):
+        index = int.__new__(cls, value)
+        index.epoch = epoch
+        return index
+
+    def __reduce__(self):
+        return (SeededIndex, (int(self), self.epoch))
+
+
+def sample_sequence(run, epoch, index):
+    return np.random.SeedSequence(run, spawn_key=(_SAMPLE, epoch, index))
+
+
+@contextmanager
+def sample_rng(run, epoch, index):
+    sequence = sample_sequence(run, epoch, index)
+    state = sequence.generate_state(3)
+    previous = getattr(_local, "rng", None)
+    _local.rng = np.random.Generator(np.random.PCG64(sequence))
+    random.seed(int(state[2]))
+    np.random.seed(int(state[0]))
+    torch.default_generator.manual_seed(int(state[1]))
+    try:
+        yield _local.rng
+    finally:
+        _local.rng = previous
+
+
+def rng():
+    """Generator of the sample being loaded, else numpy's global RandomState."""
+    current = getattr(_local, "rng", None)
+    return np.random if current is None else current
+
+
+def integers(generator, low, high):
+    """Uniform integer in [low, high) from a Generator or a RandomState."""
+    if isinstance(generator, np.random.Generator):
+        return int(generator.integers(low, high))
+    return int(generator.randint(low, high))
+
+
+class WorkerInit(object):
+
+    def __init__(self, run):
+        self.run = run
+
+    def __call__(self, worker_id):
+        # torch.initial_seed() is the loader's base seed + worker_id, new
+        # every time the workers are started (every epoch unless persistent)
+        state = np.random.SeedSequence([self.run, torch.initial_seed()], spawn_key=(_WORKER, worker_id)).generate_state(3)
+        random.seed(int(state[0]))
+        np.random.seed(int(state[1]))
+        torch.manual_seed(int(state[2]))
+
+
+def worker_init(run):
+    """worker_init_fn seeding every DataLoader worker from (run, worker id)
+    and the loader's per-epoch base seed."""
+    return WorkerInit(run)
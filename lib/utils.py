@@ -60,12 +60,16 @@ def accuracy(output, target, topk=(1,)):
         res.append(correct_k.mul_(100.0 / batch_size))
     return res
 
-def multi_class_auc(all_target, all_output, num_c = None):
+def multi_class_auc(all_target, all_output, num_c = None, soft=False):
     from sklearn.preprocessing import label_binarize
 
     # all_output = np.stack(all_output)
     all_target = label_binarize(all_target, classes=list(range(0, num_c)))
-    all_output = label_binarize(all_output, classes=list(range(0, num_c)))
+    if soft:
+        # per-class scores (N x C) instead of hard predictions
+        all_output = np.asarray(all_output)
+    else:
+        all_output = label_binarize(all_output, classes=list(range(0, num_c)))
     auc_sum = []
 
     for num_class in range(0, num_c):
@@ -79,9 +83,16 @@ def multi_class_auc(all_target, all_output, num_c = None):
 
     return auc
 
-def evaluation_metrics(label, pred, C):
+def evaluation_metrics(label, pred, C, score=None):
+    """score (N x C), if given, is used for the AUC instead of the hard pred"""
 
-    if C==2:
+    if score is not None:
+        score = np.asarray(score)
+        if C==2:
+            auc = roc_auc_score(label, score[:, 1])
+        else:
+            auc = multi_class_auc(label, score, num_c=C, soft=True)
+    elif C==2:
         auc = roc_auc_score(label, pred)
     else:
         auc = multi_class_auc(label, pred, num_c=C)
@@ -97,6 +108,144 @@ def evaluation_metrics(label, pred, C):
     return round(auc, 4), round(acc, 4), round(precision, 4), round(recall, 4), round(f1score, 4)
 
 
+def _bootstrap_auc(label, idx, score, C):
+    """AUC of every resample (rows of idx), one-vs-rest for C > 2.
+    Scores are replaced by their tie-group rank so each resample reduces to
+    per-group positive/negative counts; ties count one half."""
+    n_boot = idx.shape[0]
+    classes = [1] if C == 2 else list(range(C))
+    aucs = np.full((n_boot, len(classes)), np.nan)
+    rows = np.arange(n_boot)[:, None]
+    for k, c in enumerate(classes):
+        _, group = np.unique(score[:, c], return_inverse=True)
+        G = group.max() + 1
+        positive = (label == c)[idx]
+        flat = (rows * G + group[idx]).ravel()
+        pos = np.bincount(flat, weights=positive.ravel(), minlength=n_boot * G).reshape(n_boot, G)
+        neg = np.bincount(flat, weights=(~positive).ravel(), minlength=n_boot * G).reshape(n_boot, G)
+        neg_below = np.cumsum(neg, 1) - neg
+        P, N = pos.sum(1), neg.sum(1)
+        valid = (P > 0) & (N > 0)
+        aucs[valid, k] = (pos * (neg_below + 0.5 * neg)).sum(1)[valid] / (P * N)[valid]
+    if C == 2:
+        return aucs[:, 0]
+    with np.errstate(invalid='ignore'):
+        return np.nanmean(aucs, 1)
+
+
+def _bootstrap_confusion_metrics(label, pred, idx, C):
+    n_boot = idx.shape[0]
+    flat = (np.arange(n_boot)[:, None] * C + label[idx]) * C + pred[idx]
+    confusion = np.bincount(flat.ravel(), minlength=n_boot * C * C).reshape(n_boot, C, C).astype(np.float64)
+
+    tp = np.diagonal(confusion, axis1=1, axis2=2)
+    n_true, n_pred = confusion.sum(2), confusion.sum(1)
+    acc = tp.sum(1) / confusion.sum((1, 2))
+
+    #  mean class, over the labels present in target or pred (as sklearn)
+    present = (n_true + n_pred) > 0
+    n_present = present.sum(1)
+    precision = (np.where(present, tp / np.maximum(n_pred, 1), 0)).sum(1) / n_present
+    recall = (np.where(present, tp / np.maximum(n_true, 1), 0)).sum(1) / n_present
+    f1score = (np.where(present, 2 * tp / np.maximum(n_true + n_pred, 1), 0)).sum(1) / n_present
+    return acc, precision, recall, f1score
+
+
+def bootstrap_metrics(label, pred, C, n_boot=2000, alpha=0.05, score=None, seed=0, chunk=2 ** 24):
+    """Percentile bootstrap for (auc, acc, precision, recall, f1score).
+    All resamples are drawn as one index matrix and scored with bincounts,
+    in chunks of at most `chunk` sampled elements.
+    Returns point estimates (as evaluation_metrics) and the lower and upper
+    bounds of the 1 - alpha interval, each an array of the five metrics."""
+    label = np.asarray(label, dtype=np.int64).reshape(-1)
+    pred = np.asarray(pred, dtype=np.int64).reshape(-1)
+    score = np.eye(C)[pred] if score is None else np.asarray(score, dtype=np.float64).reshape(-1, C)
+    n = len(label)
+
+    def metrics(idx):
+        return np.stack([_bootstrap_auc(label, idx, score, C)] + list(_bootstrap_confusion_metrics(label, pred, idx, C)), 1)
+
+    point = metrics(np.arange(n)[None, :])[0]
+
+    rng = np.random.RandomState(seed)
+    step = max(1, chunk // n)
+    resampled = []
+    for start in range(0, n_boot, step):
+        idx = rng.randint(0, n, size=(min(step, n_boot - start), n))
+        resampled.append(metrics(idx))
+    resampled = np.concatenate(resampled, 0)
+
+    lower = np.nanpercentile(resampled, 100 * alpha / 2, axis=0)
+    upper = np.nanpercentile(resampled, 100 * (1 - alpha / 2), axis=0)
+    return point, lower, upper
+
+
+class StreamingMetrics(object):
+    """Constant-memory replacement for collecting predictions and calling
+    evaluation_metrics at the end: a C x C confusion matrix plus, per class,
+    a fixed-bin histogram of the scores of its negatives and positives.
+    Scores default to the one-hot prediction, which makes the AUC identical
+    to evaluation_metrics on hard predictions; soft scores must lie in [0, 1].
+    Meters from different processes are combined with merge()."""
+    def __init__(self, C, bins=1000):
+        self.C = C
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        self.confusion = np.zeros((self.C, self.C), dtype=np.int64)
+        self.hist = np.zeros((self.C, 2, self.bins), dtype=np.int64)
+
+    def update(self, target, pred, score=None):
+        target = np.asarray(target, dtype=np.int64).reshape(-1)
+        pred = np.asarray(pred, dtype=np.int64).reshape(-1)
+        C, bins = self.C, self.bins
+
+        self.confusion += np.bincount(target * C + pred, minlength=C * C).reshape(C, C)
+
+        if score is None:
+            score = np.eye(C)[pred]
+        score = np.clip(np.asarray(score, dtype=np.float64).reshape(-1, C), 0, 1)
+        b = np.minimum((score * bins).astype(np.int64), bins - 1)
+        positive = target[:, None] == np.arange(C)[None, :]
+        flat = (np.arange(C)[None, :] * 2 + positive) * bins + b
+        self.hist += np.bincount(flat.ravel(), minlength=C * 2 * bins).reshape(C, 2, bins)
+
+    def merge(self, other):
+        self.confusion += other.confusion
+        self.hist += other.hist
+        return self
+
+    def class_auc(self, c):
+        neg, pos = self.hist[c, 0].astype(np.float64), self.hist[c, 1].astype(np.float64)
+        P, N = pos.sum(), neg.sum()
+        if P == 0 or N == 0:
+            return None
+        # ties within a bin count one half, as in roc_auc_score
+        neg_below = np.cumsum(neg) - neg
+        return float((pos * (neg_below + 0.5 * neg)).sum() / (P * N))
+
+    def compute(self):
+        if self.C == 2:
+            auc = self.class_auc(1)
+        else:
+            auc_sum = [a for a in map(self.class_auc, range(self.C)) if a is not None]
+            auc = sum(auc_sum) / (float(len(auc_sum)) + 1e-8)
+
+        confusion = self.confusion.astype(np.float64)
+        tp = np.diag(confusion)
+        n_true, n_pred = confusion.sum(1), confusion.sum(0)
+        acc = tp.sum() / confusion.sum()
+
+        #  mean class, over the labels present in target or pred (as sklearn)
+        present = (n_true + n_pred) > 0
+        precision = np.where(n_pred > 0, tp / np.maximum(n_pred, 1), 0)[present].mean()
+        recall = np.where(n_true > 0, tp / np.maximum(n_true, 1), 0)[present].mean()
+        f1score = (2 * tp / np.maximum(n_true + n_pred, 1))[present].mean()
+
+        return round(auc, 4), round(acc, 4), round(precision, 4), round(recall, 4), round(f1score, 4)
+
+
 
 def showfeature(x, savename):
     # trun to numpy
@@ -9,15 +9,25 @@ import torch.optim
 import torch.utils.data
 import torch.utils.data.distributed
 import torchvision.transforms as transforms
+import lib.cv_transforms as cv_transforms
 
 import models
 import random
+from lib.seeding import worker_init
 from lib.LinearAverage import LinearAverage
 from lib.BatchAverage import BatchCriterion
 from lib.BatchAverageRot import BatchCriterionRot
 from lib.BatchAverageFour import BatchCriterionFour
 from lib.utils import AverageMeter
-from test import kNN
+from datasets.batched import batched
+from datasets.seeded import seeded
+from datasets.in_memory import InMemoryLoader
+from datasets.mixture import SOURCES, mixture, source_module
+from lib.batch_augment import BatchAugment, Uint8Normalize
+from lib.collate import ViewCollate, cat_views
+from lib.samplers import EpochSampler, InfiniteSampler, MixtureSampler, NeighbourBatchSampler, forever
+from lib.prefetch import RotationBatch, RotationPrefetcher, build_rotation_batch
+from test import kNN, prototype, labelprop
 import numpy as np
 
 from lib.utils import save_checkpoint, adjust_learning_rate
@@ -38,8 +48,49 @@ parser.add_argument('--arch', '-a', metavar='ARCH', default='resnet18',
                         ' (default: resnet18)')
 parser.add_argument('-j', '--workers', default=4, type=int, metavar='N',
                     help='number of data loading workers (default: 4)')
+parser.add_argument('--load-threads', default=0, type=int, metavar='N',
+                    help='threads decoding images when a dataset is built (default: 0, one per core up to 16)')
+parser.add_argument('--packed', default='', type=str, metavar='PREFIX',
+                    help='read images from a store written by datasets/packed_store.py')
+parser.add_argument('--image-cache-mb', default=0, type=int, metavar='MB',
+                    help='decoded images kept per process across folds and datasets (default: 0, off: one fold per process never reuses them)')
+parser.add_argument('--aug-backend', default='pil', choices=['pil', 'cv2'],
+                    help='augment PIL images with torchvision or uint8 arrays with lib/cv_transforms.py (RGB, as ImageNet normalisation expects)')
+parser.add_argument('--in-memory', action='store_true',
+                    help='keep the training set on the GPU as one uint8 tensor and augment whole batches there (RGB, needs --aug-backend cv2)')
+parser.add_argument('--uint8-transfer', action='store_true',
+                    help='training views leave the workers as uint8 and are normalised per batch on the GPU')
+parser.add_argument('--seeded-aug', action='store_true',
+                    help='draw augmentations from per (run, epoch, sample) seeds, identical for any number of workers')
+parser.add_argument('--view-collate', action='store_true',
+                    help='collate training views into one [views * B, C, H, W] shared-memory tensor in the layout the criterion expects')
+parser.add_argument('--prefetch-rot', action='store_true',
+                    help='with --multitaskposrot, build the next rotated batch on a background thread into double-buffered GPU tensors')
+parser.add_argument('--rotstem', action='store_true',
+                    help='with --multitaskposrot, feed upright images and let conv1 produce the 4 rotations with rotated filters '
+                         '(exact, but rotating the 64-channel maps back moves ~5x the bytes of rotating the inputs and ran ~30%% slower on CPU)')
+parser.add_argument('--hard-neg', default=0., type=float, metavar='FRAC',
+                    help='fraction of every batch drawn from one k-means cluster of the memory bank (0: off)')
+parser.add_argument('--hard-neg-clusters', default=0, type=int,
+                    help='clusters for --hard-neg (default: 0, dataset size / batch size)')
+parser.add_argument('--hard-neg-every', default=1, type=int,
+                    help='epochs between reclustering the memory bank for --hard-neg')
+parser.add_argument('--rot-k', default=4, type=int, choices=[1, 2, 4],
+                    help='with --multitaskposrot, rotations per view: 4 uses all of them, 1 or 2 draws that many at random')
+parser.add_argument('--fetch-threads', default=0, type=int, metavar='N',
+                    help='decode and augment each training batch with N threads per loader worker (default: 0, per sample)')
+parser.add_argument('--stratify', action='store_true',
+                    help='stratify the cross-validation folds by label (cached next to the fold list)')
+parser.add_argument('--fold-cache', default='', type=str, metavar='DIR',
+                    help='write the fold caches to DIR instead of next to the fold lists (e.g. for a read-only data tree)')
 parser.add_argument('--epochs', default=3201, type=int, metavar='N',
                     help='number of total epochs to run')
+parser.add_argument('--iters', default=0, type=int, metavar='N',
+                    help='train for N steps over an endless sampler with persistent workers instead of --epochs (default: 0, off)')
+parser.add_argument('--lr-steps', default='', type=str, metavar='A,B',
+                    help='steps at which --iters decays the lr by 10 (default: epochs 1000,2000 in steps)')
+parser.add_argument('--save-step', default=-1, type=int, metavar='N',
+                    help='step checkpointed by --iters (default: epoch 2000 in steps)')
 parser.add_argument('--start-epoch', default=0, type=int, metavar='N',
                     help='manual epoch number (useful on restarts)')
 parser.add_argument('-b', '--batch-size', default=256, type=int,
@@ -79,9 +130,26 @@ parser.add_argument('--multiaug', action="store_true")
 parser.add_argument('--multitask', action="store_true")
 parser.add_argument("--multitaskposrot", action="store_true")
 best_prec1 = 0
+normalize_uint8 = Uint8Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 
 
 parser.add_argument("--saveembed", type=str, default="")
+parser.add_argument("--dataset", default="amd", choices=sorted(SOURCES),
+                    help='dataset module to train and evaluate on')
+parser.add_argument("--sources", type=str, default="",
+                    help='pretrain on a weighted mixture of sources, e.g. amd:1,gon:1,dr:2 (evaluation stays on --dataset)')
+parser.add_argument("--mix-samples", default=0, type=int,
+                    help='samples per epoch with --sources (default: 0, all sources once)')
+parser.add_argument("--lmdb", type=str, default="",
+                    help='kaggle DR train images from a datasets/lmdb_store.py store')
+parser.add_argument("--proto", default=0, type=int,
+                    help='also evaluate with N prototypes per class (0: kNN only)')
+parser.add_argument("--labelprop", default=0, type=int,
+                    help='also evaluate with label propagation on a top-K graph (0: off)')
+parser.add_argument("--soft-auc", action="store_true",
+                    help='compute the kNN AUC from the normalised votes instead of the hard predictions (not comparable with the paper)')
+parser.add_argument("--savepred", action="store_true",
+                    help='save kNN predictions to savemodels/pred_fold<N>.npz for read_result.py --bootstrap')
 
 
 def get_learnable_para(model):
@@ -92,6 +160,17 @@ def main():
 
     global args, best_prec1
     args = parser.parse_args()
+    args.start_step = 0
+    if args.rotstem and args.rot_k != 4:
+        parser.error("--rotstem computes all 4 rotations, use it with --rot-k 4")
+    if args.in_memory and args.aug_backend != 'cv2':
+        # the batches are RGB uint8 tensors, and kNN has to see the same preprocessing through the DataLoader
+        parser.error("--in-memory augments RGB uint8 tensors, use it with --aug-backend cv2")
+    if args.hard_neg > 0 and (args.in_memory or args.iters):
+        parser.error("--hard-neg samples batches per epoch through the DataLoader")
+    if args.sources and (args.in_memory or args.iters or args.hard_neg > 0 or not args.multiaug or args.synthesis):
+        parser.error("--sources needs --multiaug (kNN recomputes the --dataset features), no --synthesis (kaggle DR has 2 views, "
+                     "the synthesis sources 4) and epoch-based DataLoader training")
 
     #  init seed
     my_whole_seed = 222
@@ -113,39 +192,69 @@ def main():
         # create model
         model = models.__dict__[args.arch](low_dim=args.low_dim, multitask=args.multitask , showfeature=args.showfeature, domain=args.domain,args=args)
         model = torch.nn.DataParallel(model).cuda()
+        if args.rotstem:
+            print("rotation stem max error: %g" % models.resnet.verify_rotation_stem(model.module.conv1))
         print ('Number of learnable params', get_learnable_para(model)/1000000., " M")
 
         # Data loading code
+        T = cv_transforms if args.aug_backend == 'cv2' else transforms
         normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                          std=[0.229, 0.224, 0.225])
 
-        aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.2, 1.)),
-                                  transforms.RandomGrayscale(p=0.2),
-                                  transforms.ColorJitter(0.4, 0.4, 0.4, 0.4),
-                                  transforms.RandomHorizontalFlip(),
-                                  transforms.ToTensor(),
-                                  normalize])
+        to_tensor = [T.ToTensor(), normalize]
+        if args.uint8_transfer:
+            # workers ship uint8 views; normalize_uint8 converts whole batches on the GPU
+            to_tensor = [cv_transforms.ToUint8Tensor() if T is cv_transforms else transforms.PILToTensor()]
+        aug = T.Compose([T.RandomResizedCrop(224, scale=(0.2, 1.)),
+                         T.RandomGrayscale(p=0.2),
+                         T.ColorJitter(0.4, 0.4, 0.4, 0.4),
+                         T.RandomHorizontalFlip()] + to_tensor)
         # aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.08, 1.), ratio=(3 / 4, 4 / 3)),
         #                           transforms.RandomHorizontalFlip(p=0.5),
         #                           get_color_distortion(s=1),
         #                           transforms.Lambda(lambda x: gaussian_blur(x)),
         #                           transforms.ToTensor(),
         #                           normalize])
-        aug_test = transforms.Compose([
-                transforms.Resize((224,224)),
-                transforms.ToTensor(),
+        aug_test = T.Compose([
+                T.Resize((224,224)),
+                T.ToTensor(),
                 normalize])
 
         # load dataset
-        import datasets.fundus_amd_syn_crossvalidation as medicaldata
-        train_dataset = medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args)
+        medicaldata = source_module(args.dataset, args)
+        train_dataset = batched(seeded(medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args), args, my_whole_seed), args)
+        train_collate = ViewCollate('interleave' if args.synthesis else 'cat') if args.view_collate else None
+        train_sampler = EpochSampler(len(train_dataset), shuffle=False, seed=my_whole_seed) if args.seeded_aug else None
         train_loader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=random.seed(my_whole_seed))
+            train_dataset, batch_size=args.batch_size, shuffle=False, sampler=train_sampler, collate_fn=train_collate, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=worker_init(my_whole_seed))
 
         valid_dataset = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, args=args)
         val_loader = torch.utils.data.DataLoader(
             valid_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4,
-            worker_init_fn=random.seed(my_whole_seed))
+            worker_init_fn=worker_init(my_whole_seed))
+
+        # the DataLoader is still used by kNN to extract features
+        if args.in_memory:
+            train_iter = InMemoryLoader(train_dataset, BatchAugment(224, scale=(0.2, 1.), grayscale=0.2, jitter=(0.4, 0.4, 0.4, 0.4)),
+                                        args.batch_size, shuffle=False, drop_last=True if args.multiaug else False)
+        elif args.hard_neg > 0:
+            # batches mixing memory-bank neighbours with random samples; the bank is attached once built
+            hard_sampler = NeighbourBatchSampler(len(train_dataset), args.batch_size, args.hard_neg, args.hard_neg_clusters,
+                                                 args.hard_neg_every, seed=my_whole_seed)
+            train_iter = torch.utils.data.DataLoader(
+                train_dataset, batch_sampler=hard_sampler, collate_fn=train_collate, pin_memory=True, num_workers=4,
+                worker_init_fn=worker_init(my_whole_seed))
+        elif args.sources:
+            # global indices across the sources, drawn at the given ratios; kNN keeps using train_loader
+            mixed, weights = mixture(args.sources, aug, args)
+            train_dataset = batched(seeded(mixed, args, my_whole_seed), args)
+            train_sampler = MixtureSampler(mixed.sizes, weights, args.mix_samples, seed=my_whole_seed)
+            train_iter = torch.utils.data.DataLoader(
+                train_dataset, batch_size=args.batch_size, sampler=train_sampler, collate_fn=train_collate, pin_memory=True, num_workers=4,
+                drop_last=True, worker_init_fn=worker_init(my_whole_seed))
+        else:
+            train_iter = train_loader
+        steps_per_epoch = len(train_iter)
 
 
         # define lemniscate and loss function (criterion)
@@ -179,6 +288,7 @@ def main():
                 print("=> loading checkpoint '{}'".format(args.resume))
                 checkpoint = torch.load(args.resume)
                 args.start_epoch = checkpoint['epoch']
+                args.start_step = checkpoint.get('step', 0)
                 model.load_state_dict(checkpoint['state_dict'])
                 lemniscate = checkpoint['lemniscate']
                 optimizer.load_state_dict(checkpoint['optimizer'])
@@ -189,14 +299,23 @@ def main():
 
         if args.evaluate:
             knn_num = 100
-            auc, acc, precision, recall, f1score = kNN(args, model, lemniscate, train_loader, val_loader, knn_num, args.nce_t, 2)
-            f = open("savemodels/result.txt", "a+")
-            f.write("auc: %.4f\n" % (auc))
-            f.write("acc: %.4f\n" % (acc))
-            f.write("pre: %.4f\n" % (precision))
-            f.write("recall: %.4f\n" % (recall))
-            f.write("f1score: %.4f\n" % (f1score))
-            f.close()
+            end = time.time()
+            save_pred = "savemodels/pred_fold" + str(args.seedstart) + ".npz" if args.savepred else ""
+            auc, acc, precision, recall, f1score = kNN(args, model, lemniscate, train_loader, val_loader, knn_num, args.nce_t, 2, save_pred=save_pred)
+            print("kNN   auc %.4f acc %.4f f1 %.4f (%.2fs)" % (auc, acc, f1score, time.time() - end))
+            save_result("savemodels/result.txt", auc, acc, precision, recall, f1score)
+
+            if args.proto:
+                end = time.time()
+                result = prototype(args, model, lemniscate, train_loader, val_loader, 2, args.proto)
+                print("proto auc %.4f acc %.4f f1 %.4f (%.2fs, %d per class)" % (result[0], result[1], result[4], time.time() - end, args.proto))
+                save_result("savemodels/result_proto.txt", *result)
+
+            if args.labelprop:
+                end = time.time()
+                result = labelprop(args, model, lemniscate, train_loader, val_loader, args.labelprop, 2)
+                print("lp    auc %.4f acc %.4f f1 %.4f (%.2fs, K=%d)" % (result[0], result[1], result[4], time.time() - end, args.labelprop))
+                save_result("savemodels/result_lp.txt", *result)
             return
 
         # mkdir result folder and tensorboard
@@ -217,12 +336,35 @@ def main():
                 os.makedirs(args.result + "/code_file/" + name, exist_ok=True)
                 shutil.copy(file, args.result + "/code_file/" + name)
 
+        if args.iters:
+            lr_steps = [int(x) for x in args.lr_steps.split(",")] if args.lr_steps else [1000 * steps_per_epoch, 2000 * steps_per_epoch]
+            save_step = args.save_step if args.save_step >= 0 else 2000 * steps_per_epoch
+            if args.in_memory:
+                batches = forever(train_iter)
+            else:
+                # one iterator for the whole run, so the workers are forked once
+                sampler = InfiniteSampler(len(train_dataset), shuffle=False, seed=my_whole_seed, start=args.start_step * args.batch_size)
+                batches = iter(torch.utils.data.DataLoader(
+                    train_dataset, batch_size=args.batch_size, sampler=sampler, collate_fn=train_collate, pin_memory=True, num_workers=4,
+                    persistent_workers=True, worker_init_fn=worker_init(my_whole_seed)))
+            if args.prefetch_rot and args.multitaskposrot:
+                batches = RotationPrefetcher(batches, normalize_uint8 if args.uint8_transfer else None, rotate_input=not args.rotstem, k=args.rot_k)
+            print("training %d steps (%d per epoch), lr steps %s" % (args.iters, steps_per_epoch, lr_steps))
+            train_iters(batches, model, lemniscate, criterion, cls_criterion, optimizer, writer, lr_steps, save_step)
+            return
+
+        if args.hard_neg > 0:
+            hard_sampler.memory = lemniscate.memory
         for epoch in range(args.start_epoch, args.epochs):
             lr = adjust_learning_rate(optimizer, epoch, args, [1000, 2000])
             writer.add_scalar("lr", lr, epoch)
+            if train_sampler is not None:
+                train_sampler.set_epoch(epoch)
+            if args.hard_neg > 0:
+                hard_sampler.set_epoch(epoch)
 
             # # train for one epoch
-            loss = train(train_loader, model, lemniscate, criterion, cls_criterion, optimizer, epoch, writer)
+            loss = train(train_iter, model, lemniscate, criterion, cls_criterion, optimizer, epoch, writer)
 
             # save checkpoint
             if epoch == 2000:
@@ -235,63 +377,45 @@ def main():
                 }, filename = args.result + "/fold" +str(args.seedstart)+"-epoch-" +str(epoch) + ".pth.tar")
 
 
-def train(train_loader, model, lemniscate, criterion, cls_criterion, optimizer, epoch, writer):
-    batch_time = AverageMeter()
-    data_time = AverageMeter()
-    losses = AverageMeter()
+def save_result(filename, auc, acc, precision, recall, f1score):
+    f = open(filename, "a+")
+    f.write("auc: %.4f\n" % (auc))
+    f.write("acc: %.4f\n" % (acc))
+    f.write("pre: %.4f\n" % (precision))
+    f.write("recall: %.4f\n" % (recall))
+    f.write("f1score: %.4f\n" % (f1score))
+    f.close()
 
-    losses_ins = AverageMeter()
-    losses_rot = AverageMeter()
 
-    # switch to train mode
-    model.train()
+def train_step(i, input, target, index, model, lemniscate, criterion, cls_criterion, optimizer):
+    """Forward and backward pass of batch i; the optimizer steps every
+    args.iter_size batches. Returns the loss and the number of inputs."""
+    if args.uint8_transfer and not isinstance(input, RotationBatch):
+        input = normalize_uint8(input)
 
-    end = time.time()
-    optimizer.zero_grad()
-
-    for i, (input, target, index, name) in enumerate(train_loader):
-        # measure data loading time
-        data_time.update(time.time() - end)
-
-        # compute output
-        if args.multitaskposrot:
-            # instance discrimination and rotation prediction
-            input = torch.cat(input, 0).cuda()
+    if args.multitaskposrot:
+        # instance discrimination and rotation prediction
+        if not isinstance(input, RotationBatch):
+            input = cat_views(input).cuda()
             index = torch.cat([index, index], 0).cuda()
             rotation_label = torch.cat([target[1], target[1]], 0).cuda()
+            input = build_rotation_batch(input, index, rotation_label, rotate_input=not args.rotstem, k=args.rot_k)
+        dataX, rotation_label, index = input.data, input.labels, input.index
 
-            # initialize tensors
-            tensors = {}
-            tensors['dataX'] = torch.FloatTensor()
-            tensors['index'] = torch.LongTensor()
-            tensors['index_index'] = torch.LongTensor()
-            tensors['labels'] = torch.LongTensor()
-
-            # construct rotated input
-            tensors['dataX'].resize_(input.size()).copy_(input)
-            dataX_90 = torch.flip(torch.transpose(input, 2, 3), [2])
-            dataX_180 = torch.flip(torch.flip(input, [2]), [3])
-            dataX_270 = torch.transpose(torch.flip(input, [2]), 2, 3)
-            dataX = torch.stack([input, dataX_90, dataX_180, dataX_270], dim=1)
-            batch_size, rotations, channels, height, width = dataX.size()
-            dataX = dataX.view([batch_size * rotations, channels, height, width])
-
-            # construct rotated label and index
-            rotation_label = torch.stack([rotation_label, torch.ones_like(rotation_label), 2*torch.ones_like(rotation_label), 3*torch.ones_like(rotation_label)], dim=1)
-            rotation_label = rotation_label.view([batch_size*rotations])
-            index = torch.stack([index, index, index, index], dim=1)
-            index = index.view([batch_size * rotations])
-
-            feature, pred_rot, feture_whole = model(dataX)
-
-            loss_instance = criterion(feature, index) / args.iter_size
-            loss_cls = cls_criterion(pred_rot, rotation_label)
-            loss =  loss_instance + 1.0 * loss_cls
-
-            losses_ins.update(loss_instance.item() * args.iter_size, input.size(0))
-            losses_rot.update(loss_cls.item() * args.iter_size, input.size(0))
+        feature, pred_rot, feture_whole = model(dataX)
 
-        elif args.synthesis:
+        loss_instance = criterion(feature, index) / args.iter_size
+        loss_cls = cls_criterion(pred_rot, rotation_label)
+        loss =  loss_instance + 1.0 * loss_cls
+        if args.hard_neg > 0:
+            # first view, first rotation slot of every sample
+            lemniscate.update(feature.view(2, -1, args.rot_k, feature.size(1))[0, :, 0], index.view(2, -1, args.rot_k)[0, :, 0])
+
+    elif args.synthesis:
+        if torch.is_tensor(input):
+            # interleaved by ViewCollate already
+            input = input.cuda()
+        else:
             dataX = torch.cat(input,0).cuda()
             ori_data = dataX[:int(dataX.shape[0]/2)]
             syn_data = dataX[int(dataX.shape[0]/2):]
@@ -300,33 +424,62 @@ def train(train_loader, model, lemniscate, criterion, cls_criterion, optimizer,
             batch_size, types, channels, height, width = dataX.size()
             input = dataX.view([batch_size * types, channels, height, width])
 
-            # instance discrimination
-            # input = torch.cat(input, 0).cuda()
-            feature = model(input)
-            loss = criterion(feature, index) / args.iter_size
-        elif args.multiaug:
+        # instance discrimination
+        # input = torch.cat(input, 0).cuda()
+        feature = model(input)
+        loss = criterion(feature, index) / args.iter_size
+        if args.hard_neg > 0:
+            # rows 2b hold the first view
+            lemniscate.update(feature[0:2 * index.size(0):2], index.cuda())
+    elif args.multiaug:
 
-            input = torch.cat(input, 0).cuda()
-            feature = model(input)
-            loss = criterion(feature, index) / args.iter_size
-        else:
-            # instance discrimination memory bank
-            input = input.cuda()
-            index = index.cuda()
+        input = cat_views(input).cuda()
+        feature = model(input)
+        loss = criterion(feature, index) / args.iter_size
+        if args.hard_neg > 0:
+            lemniscate.update(feature[:index.size(0)], index.cuda())
+    else:
+        # instance discrimination memory bank
+        input = input.cuda()
+        index = index.cuda()
+
+        feature = model(input)
+        output = lemniscate(feature, index)
+        loss = criterion(output, index) / args.iter_size
+
+    loss.backward()
+
+    if (i+1) % args.iter_size == 0:
+        # compute gradient and do SGD step
+        optimizer.step()
+        optimizer.zero_grad()
 
-            feature = model(input)
-            output = lemniscate(feature, index)
-            loss = criterion(output, index) / args.iter_size
+    return loss.item() * args.iter_size, input.size(0)
 
-        loss.backward()
 
-        # measure accuracy and record loss
-        losses.update(loss.item() * args.iter_size, input.size(0))
+def train(train_loader, model, lemniscate, criterion, cls_criterion, optimizer, epoch, writer):
+    batch_time = AverageMeter()
+    data_time = AverageMeter()
+    losses = AverageMeter()
+
+    # switch to train mode
+    model.train()
+
+    end = start = time.time()
+    optimizer.zero_grad()
+    images = 0
 
-        if (i+1) % args.iter_size == 0:
-            # compute gradient and do SGD step
-            optimizer.step()
-            optimizer.zero_grad()
+    if args.prefetch_rot and args.multitaskposrot:
+        train_loader = RotationPrefetcher(train_loader, normalize_uint8 if args.uint8_transfer else None, rotate_input=not args.rotstem, k=args.rot_k)
+
+    for i, (input, target, index, name) in enumerate(train_loader):
+        # measure data loading time
+        data_time.update(time.time() - end)
+
+        # compute output, measure accuracy and record loss
+        loss, n = train_step(i, input, target, index, model, lemniscate, criterion, cls_criterion, optimizer)
+        losses.update(loss, n)
+        images += n * images_per_input()
 
         # measure elapsed time
         batch_time.update(time.time() - end)
@@ -340,6 +493,76 @@ def train(train_loader, model, lemniscate, criterion, cls_criterion, optimizer,
                    epoch, i, len(train_loader), batch_time=batch_time,
                    data_time=data_time, loss=losses))
 
+    if isinstance(train_loader, RotationPrefetcher):
+        report_prefetch(train_loader, writer, epoch)
+    writer.add_scalar("loss", losses.avg, epoch)
+    writer.add_scalar("images_per_sec", images / (time.time() - start), epoch)
+
+    return losses.avg
+
+
+def images_per_input():
+    """Images forwarded per loaded view."""
+    return args.rot_k if args.multitaskposrot else 1
+
+
+def report_prefetch(prefetcher, writer, step):
+    stats = prefetcher.stats()
+    writer.add_scalar("prefetch/hidden_pct", stats["hidden_pct"], step)
+    writer.add_scalar("prefetch/wait", stats["wait"], step)
+    print('Rotation prefetch: {batches} batches, assembly {assembly:.2f}s, '
+          'waited {wait:.2f}s, hidden {hidden:.2f}s ({hidden_pct:.1f}%)'.format(**stats))
+
+
+def train_iters(batches, model, lemniscate, criterion, cls_criterion, optimizer, writer, lr_steps, save_step):
+    """Steps args.start_step..args.iters-1 over an endless batch iterator,
+    with the learning rate schedule and checkpoint keyed by step."""
+    batch_time = AverageMeter()
+    data_time = AverageMeter()
+    losses = AverageMeter()
+
+    # switch to train mode
+    model.train()
+
+    end = time.time()
+    optimizer.zero_grad()
+
+    for step in range(args.start_step, args.iters):
+        lr = adjust_learning_rate(optimizer, step, args, lr_steps)
+        input, target, index, name = next(batches)
+        # measure data loading time
+        data_time.update(time.time() - end)
+
+        loss, n = train_step(step, input, target, index, model, lemniscate, criterion, cls_criterion, optimizer)
+        losses.update(loss, n)
+
+        # measure elapsed time
+        batch_time.update(time.time() - end)
+        end = time.time()
+
+        if step % args.print_freq == 0:
+            writer.add_scalar("lr", lr, step)
+            writer.add_scalar("loss", losses.avg, step)
+            writer.add_scalar("images_per_sec", n * images_per_input() / batch_time.avg, step)
+            print('Step: [{0}/{1}]\t'
+                  'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+                  'Data {data_time.val:.3f} ({data_time.avg:.3f})\t'
+                  'Loss {loss.val:.4f} ({loss.avg:.4f})\t'.format(
+                   step, args.iters, batch_time=batch_time,
+                   data_time=data_time, loss=losses))
+            if isinstance(batches, RotationPrefetcher):
+                report_prefetch(batches, writer, step)
+
+        if step == save_step:
+            save_checkpoint({
+                'epoch': 0,
+                'step': step + 1,
+                'arch': args.arch,
+                'state_dict': model.state_dict(),
+                'lemniscate': lemniscate,
+                'optimizer' : optimizer.state_dict(),
+            }, filename = args.result + "/fold" +str(args.seedstart)+"-step-" +str(step) + ".pth.tar")
+
     return losses.avg
 
 
@@ -12,6 +12,7 @@ import torchvision.transforms as transforms
 
 import models
 import random
+from lib.seeding import worker_init
 from lib.LinearAverage import LinearAverage
 from lib.BatchAverage import BatchCriterion
 from lib.BatchAverageRot import BatchCriterionRot
@@ -38,6 +39,16 @@ parser.add_argument('--arch', '-a', metavar='ARCH', default='resnet18',
                         ' (default: resnet18)')
 parser.add_argument('-j', '--workers', default=4, type=int, metavar='N',
                     help='number of data loading workers (default: 4)')
+parser.add_argument('--load-threads', default=0, type=int, metavar='N',
+                    help='threads decoding images when a dataset is built (default: 0, one per core up to 16)')
+parser.add_argument('--packed', default='', type=str, metavar='PREFIX',
+                    help='read images from a store written by datasets/packed_store.py')
+parser.add_argument('--image-cache-mb', default=0, type=int, metavar='MB',
+                    help='decoded images kept per process across folds and datasets (default: 0, off: one fold per process never reuses them)')
+parser.add_argument('--stratify', action='store_true',
+                    help='stratify the cross-validation folds by label (cached next to the fold list)')
+parser.add_argument('--fold-cache', default='', type=str, metavar='DIR',
+                    help='write the fold caches to DIR instead of next to the fold lists (e.g. for a read-only data tree)')
 parser.add_argument('--epochs', default=3201, type=int, metavar='N',
                     help='number of total epochs to run')
 parser.add_argument('--start-epoch', default=0, type=int, metavar='N',
@@ -141,12 +152,12 @@ def main():
         import datasets.fundus_amd_syn_crossvalidation_ind as medicaldata
         train_dataset = medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args)
         train_loader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=random.seed(my_whole_seed))
+            train_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=worker_init(my_whole_seed))
 
         valid_dataset = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, args=args)
         val_loader = torch.utils.data.DataLoader(
             valid_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4,
-            worker_init_fn=random.seed(my_whole_seed))
+            worker_init_fn=worker_init(my_whole_seed))
 
 
         # define lemniscate and loss function (criterion)
@@ -5,6 +5,7 @@ from lib.normalize import Normalize
 import torch
 import torch.nn.functional as F
 from lib.utils import showfeature, showimage
+from lib.prefetch import rotate
 import numpy as np
 import random
 import torch.backends.cudnn as cudnn
@@ -45,6 +46,53 @@ def conv3x3(in_planes, out_planes, stride=1):
                      padding=1, bias=False)
 
 
+def rotation_kernels(weight, shift=1):
+    """The 7x7 stride 2 stem filters for the 0/90/180/270 degree rotations,
+    embedded in (7 + shift)^2 so that conv(rotate(x, r), weight) ==
+    rotate(conv(pad(x, 3, 3 + shift), kernel r), r). On an even input the
+    stride 2 grid of a flipped axis starts one pixel later (shift 1), on an
+    odd one it lines up with the unflipped grid (shift 0)."""
+    out, inp, k, _ = weight.shape
+    kernels = weight.new_zeros(4, out, inp, k + shift, k + shift)
+    kernels[0, :, :, :k, :k] = weight
+    kernels[1, :, :, :k, shift:] = torch.transpose(torch.flip(weight, [2]), 2, 3)
+    kernels[2, :, :, shift:, shift:] = torch.flip(weight, [2, 3])
+    kernels[3, :, :, shift:, :k] = torch.flip(torch.transpose(weight, 2, 3), [2])
+    return kernels.view(4 * out, inp, k + shift, k + shift)
+
+
+def rotation_stem(x, weight):
+    """conv1 (7x7, stride 2, padding 3) of the 4 rotations of an upright
+    square batch N x C x S x S, computed as one convolution of x with the
+    4 x 64 rotated filters; the maps are rotated back into rows n * 4 + r.
+    Non-square inputs have no single rotated batch and are refused."""
+    if x.dim() != 4 or x.size(2) != x.size(3):
+        raise ValueError("rotation stem needs square N x C x S x S inputs, got %s" % (tuple(x.shape),))
+    if tuple(weight.shape[2:]) != (7, 7):
+        raise ValueError("rotation stem needs the 7x7 conv1, got %s filters" % (tuple(weight.shape[2:]),))
+    n = x.size(0)
+    shift = 1 - x.size(2) % 2
+    y = F.conv2d(F.pad(x, (3, 3 + shift, 3, 3 + shift)), rotation_kernels(weight, shift), stride=2)
+    y = y.view((n, 4, weight.size(0)) + y.shape[2:])
+    y = torch.stack([rotate(y[:, r], r) for r in range(4)], dim=1)
+    return y.view((n * 4,) + y.shape[2:])
+
+
+def verify_rotation_stem(conv1, size=224, batch=2, tol=1e-4):
+    """Largest difference between conv1 on the rotated batch and
+    rotation_stem on a random batch; raises if it is above tol."""
+    if conv1.kernel_size != (7, 7) or conv1.stride != (2, 2) or conv1.padding != (3, 3):
+        raise ValueError("rotation stem needs a 7x7 stride 2 padding 3 conv1")
+    weight = conv1.weight.detach()
+    x = torch.randn(batch, weight.size(1), size, size, device=weight.device)
+    with torch.no_grad():
+        expected = conv1(torch.stack([rotate(x, r) for r in range(4)], dim=1).view((batch * 4,) + x.shape[1:]))
+        error = (rotation_stem(x, weight) - expected).abs().max().item()
+    if error > tol:
+        raise RuntimeError("rotation stem differs from the rotated input by %g" % error)
+    return error
+
+
 class BasicBlock(nn.Module):
     expansion = 1
 
@@ -136,6 +184,8 @@ class ResNet(nn.Module):
         self.fc = nn.Linear(512 * block.expansion, low_dim)
         self.l2norm = Normalize(2)
         self.saveembed = args.saveembed
+        # training batches are upright, conv1 produces their 4 rotations
+        self.rotstem = getattr(args, "rotstem", False)
 
 
         self.showfeature = showfeature
@@ -225,7 +275,10 @@ class ResNet(nn.Module):
         # showimage(x[225], "batch-225-image.png")
         # exit(0)
 
-        x = self.conv1(x)
+        if self.rotstem and self.training:
+            x = rotation_stem(x, self.conv1.weight)
+        else:
+            x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
         x = self.maxpool(x)
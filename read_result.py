@@ -7,6 +7,12 @@ parser = argparse.ArgumentParser(description='PyTorch ImageNet Training')
 # parser.add_argument('result', metavar='DIR',
 #                     help='path of result')
 # parser.add_argument('epoch', type=int, default=2000)
+parser.add_argument('--file', default="savemodels/result.txt", type=str,
+                    help='result file to summarise, e.g. savemodels/result_proto.txt')
+parser.add_argument('--bootstrap', default=0, type=int,
+                    help='bootstrap resamples over savemodels/pred_fold*.npz (0: off)')
+parser.add_argument('--soft', action='store_true',
+                    help='bootstrap the AUC from the kNN class scores even for folds evaluated without --soft-auc')
 args = parser.parse_args()
 
 def read_result():
@@ -32,7 +38,7 @@ def read_result():
     print ("std ", np.around(std*100, decimals=2))
 
 def read_txtfile():
-    data = np.genfromtxt("savemodels/result.txt", usecols=1, dtype=float)
+    data = np.genfromtxt(args.file, usecols=1, dtype=float)
     results = np.reshape(data, (5,5))
     a = np.mean(results,axis=0)
     print ("5-fold result: ")
@@ -42,8 +48,40 @@ def read_txtfile():
     print ("recall", np.around(a[3]*100, decimals=2))
     print ("f1score", np.around(a[4]*100, decimals=2))
 
+def read_bootstrap():
+    import time
+    from lib.utils import bootstrap_metrics
+
+    names = ["AUC", "acc", "precision", "recall", "f1score"]
+
+    def report(title, label, pred, score, soft, reported=None):
+        end = time.time()
+        point, lower, upper = bootstrap_metrics(label, pred, 2, n_boot=args.bootstrap, score=score if soft else None)
+        print (title, "(%d samples, %s AUC, %.2fs)" % (len(label), "soft" if soft else "hard", time.time() - end))
+        for name, p, l, u in zip(names, point, lower, upper):
+            print ("  %-9s %.2f  [%.2f, %.2f]" % (name, p*100, l*100, u*100))
+        # soft scores are binned by StreamingMetrics, hence the tolerance
+        if reported is not None and abs(point[0] - reported) > 1e-3:
+            print ("  warning: point AUC %.4f differs from the %.4f test.py reported" % (point[0], reported))
+
+    labels, preds, scores, softs = [], [], [], []
+    for i in list(range(0, 5)):
+        data = np.load("savemodels/pred_fold" + str(i) + ".npz")
+        labels.append(data["label"])
+        preds.append(data["pred"])
+        scores.append(data["score"])
+        # the AUC the evaluator reported (files saved before it was recorded are hard)
+        evaluated_soft = bool(data["soft"]) if "soft" in data.files else False
+        softs.append(args.soft or evaluated_soft)
+        reported = float(data["auc"]) if "auc" in data.files and softs[-1] == evaluated_soft else None
+        report("fold %d" % i, labels[-1], preds[-1], scores[-1], softs[-1], reported)
+    report("pooled", np.concatenate(labels), np.concatenate(preds), np.concatenate(scores), all(softs))
+
 
 if __name__ == '__main__':
+    if args.bootstrap:
+        read_bootstrap()
+        exit(0)
     read_txtfile()
     # read_result()
 
@@ -4,9 +4,11 @@ for i in `seq 0 $max`
 do
   NUM="${var}$i"
   CUDA_VISIBLE_DEVICES='3' python main.py   ./data/ --arch resnet18 -j 32  --nce-t 0.07 --lr 1e-4 --nce-m 0.5 --low-dim 128 -b 75 \
-  --result exp/fundus_amd/AMD_miccai_lambda2 --seedstart  $NUM  --multiaug    --multitaskposrot --multitask  --evaluate --resume savemodels/fold$NUM-epoch-2000.pth.tar
+  --result exp/fundus_amd/AMD_miccai_lambda2 --seedstart  $NUM  --multiaug    --multitaskposrot --multitask  --evaluate --resume savemodels/fold$NUM-epoch-2000.pth.tar --savepred
 done
 python read_result.py
+# 95% bootstrap intervals per fold and pooled over the saved predictions
+python read_result.py --bootstrap 2000
 
 
 ## evaluate DR-pretrained model on AMD
@@ -19,3 +21,17 @@ do
   --result exp/fundus_amd/AMD_miccai_lambda2 --seedstart  $NUM  --multiaug    --multitaskposrot --multitask  --evaluate --resume savemodels/DR-pretrain-model.pth.tar
 done
 python read_result.py
+
+
+## compare kNN with the class-centroid classifier (1 prototype per class) and label propagation (K=10)
+rm -rf savemodels/result.txt savemodels/result_proto.txt savemodels/result_lp.txt
+max=4
+for i in `seq 0 $max`
+do
+  NUM="${var}$i"
+  CUDA_VISIBLE_DEVICES='3' python main.py   ./data/ --arch resnet18 -j 32  --nce-t 0.07 --lr 1e-4 --nce-m 0.5 --low-dim 128 -b 75 \
+  --result exp/fundus_amd/AMD_miccai_lambda2 --seedstart  $NUM  --multiaug    --multitaskposrot --multitask  --evaluate --resume savemodels/fold$NUM-epoch-2000.pth.tar --proto 1 --labelprop 10
+done
+python read_result.py
+python read_result.py --file savemodels/result_proto.txt
+python read_result.py --file savemodels/result_lp.txt
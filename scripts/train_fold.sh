@@ -9,11 +9,11 @@ done
 
 
 ## our method trained on DR,
-### modify main.py line 140 to import datasets.fundus_kaggle_dr as medicaldata
+### --dataset dr trains on datasets/fundus_kaggle_dr.py; --sources amd:1,gon:1,pm:1,dr:2 mixes sources in one run
 max=4
 for i in `seq 0 $max`
 do
   NUM="${var}$i"
   CUDA_VISIBLE_DEVICES='3' python main.py   ./data/ --arch resnet18 -j 32  --nce-t 0.07 --lr 1e-4 --nce-m 0.5 --low-dim 128 -b 128 \
-  --result exp/fundus_dr/DR_miccai --seedstart  $NUM  --multiaug    --multitaskposrot --multitask
+  --result exp/fundus_dr/DR_miccai --seedstart  $NUM  --multiaug    --multitaskposrot --multitask --dataset dr
 done
\ No newline at end of file
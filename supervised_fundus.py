@@ -9,11 +9,13 @@ import torch.optim
 import torch.utils.data
 import torch.utils.data.distributed
 import torchvision.transforms as transforms
+import lib.cv_transforms as cv_transforms
 
 import models
 import random
-from sklearn.metrics import roc_auc_score, precision_score, f1_score, recall_score
-from lib.utils import AverageMeter
+from lib.seeding import worker_init
+from lib.utils import AverageMeter, StreamingMetrics
+from datasets.batched import batched
 import numpy as np
 
 from lib.utils import save_checkpoint, adjust_learning_rate
@@ -34,6 +36,23 @@ parser.add_argument('--arch', '-a', metavar='ARCH', default='resnet18',
                         ' (default: resnet18)')
 parser.add_argument('-j', '--workers', default=4, type=int, metavar='N',
                     help='number of data loading workers (default: 4)')
+parser.add_argument('--load-threads', default=0, type=int, metavar='N',
+                    help='threads decoding images when a dataset is built (default: 0, one per core up to 16)')
+parser.add_argument('--packed', default='', type=str, metavar='PREFIX',
+                    help='read images from a store written by datasets/packed_store.py')
+parser.add_argument('--image-cache-mb', default=1024, type=int, metavar='MB',
+                    help='decoded images kept per process across folds and datasets (default: 1024, 0: off; on here '
+                         'because --seedstart..--seedend loops over folds in one process, unlike main.py)')
+parser.add_argument('--aug-backend', default='pil', choices=['pil', 'cv2'],
+                    help='augment PIL images with torchvision or uint8 arrays with lib/cv_transforms.py (RGB, as ImageNet normalisation expects)')
+parser.add_argument('--fetch-threads', default=0, type=int, metavar='N',
+                    help='decode and augment each training batch with N threads per loader worker (default: 0, per sample)')
+parser.add_argument('--soft-auc', action='store_true',
+                    help='compute the AUC from the softmax output instead of the hard predictions (not comparable with the paper)')
+parser.add_argument('--stratify', action='store_true',
+                    help='stratify the cross-validation folds by label (cached next to the fold list)')
+parser.add_argument('--fold-cache', default='', type=str, metavar='DIR',
+                    help='write the fold caches to DIR instead of next to the fold lists (e.g. for a read-only data tree)')
 parser.add_argument('--epochs', default=3201, type=int, metavar='N',
                     help='number of total epochs to run')
 parser.add_argument('--start-epoch', default=0, type=int, metavar='N',
@@ -122,15 +141,16 @@ def main():
 
 
         # Data loading code
+        T = cv_transforms if args.aug_backend == 'cv2' else transforms
         normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                          std=[0.229, 0.224, 0.225])
 
-        aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.2, 1.)),
-                                  # transforms.RandomGrayscale(p=0.2),
-                                  # transforms.ColorJitter(0.4, 0.4, 0.4, 0.4),
-                                  transforms.RandomHorizontalFlip(),
-                                  transforms.ToTensor(),
-                                  normalize])
+        aug = T.Compose([T.RandomResizedCrop(224, scale=(0.2, 1.)),
+                         # T.RandomGrayscale(p=0.2),
+                         # T.ColorJitter(0.4, 0.4, 0.4, 0.4),
+                         T.RandomHorizontalFlip(),
+                         T.ToTensor(),
+                         normalize])
         # aug = transforms.Compose([transforms.RandomResizedCrop(224, scale=(0.08, 1.), ratio=(3 / 4, 4 / 3)),
         #                           transforms.RandomHorizontalFlip(p=0.5),
         #                           get_color_distortion(s=1),
@@ -144,22 +164,22 @@ def main():
         #                           transforms.RandomHorizontalFlip(),
         #                           transforms.ToTensor(),
         #                             normalize])
-        aug_test = transforms.Compose([
-                transforms.Resize(224),
-                transforms.ToTensor(),
+        aug_test = T.Compose([
+                T.Resize(224),
+                T.ToTensor(),
                 normalize])
 
         # dataset
         import datasets.fundus_amd_syn_crossvalidation as medicaldata
-        train_dataset = medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args)
+        train_dataset = batched(medicaldata.traindataset(root=args.data, transform=aug, train=True, args=args), args)
         train_loader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=random.seed(my_whole_seed))
+            train_dataset, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=4, drop_last=True if args.multiaug else False,  worker_init_fn=worker_init(my_whole_seed))
 
 
         valid_dataset = medicaldata.traindataset(root=args.data, transform=aug_test, train=False, args=args)
         val_loader = torch.utils.data.DataLoader(
             valid_dataset, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=4,
-            worker_init_fn=random.seed(my_whole_seed))
+            worker_init_fn=worker_init(my_whole_seed))
 
         criterion = nn.CrossEntropyLoss().cuda()
         optimizer = torch.optim.Adam(model.parameters(), args.lr,
@@ -216,7 +236,7 @@ def main():
 
             gap_int = 200
             if (epoch) % gap_int == 0:
-                loss_val, auc, acc, precision, recall, f1score = supervised_evaluation(model, val_loader)
+                loss_val, auc, acc, precision, recall, f1score = supervised_evaluation(model, val_loader, args.soft_auc)
                 writer.add_scalar("test_auc", auc, epoch)
                 writer.add_scalar("test_acc", acc, epoch)
                 writer.add_scalar("test_precision", precision, epoch)
@@ -245,45 +265,33 @@ def main():
 
 
 
-def supervised_evaluation(model, val_loader):
+def supervised_evaluation(model, val_loader, soft_auc=False):
     batch_time = AverageMeter()
     losses = AverageMeter()
 
     # switch to evaluate mode
     model.train()
 
-    prediction_box = []
-    target_box = []
+    meter = StreamingMetrics(2)
     with torch.no_grad():
         end = time.time()
         for i, (images, target, index, name) in enumerate(val_loader):
 
             images = images.cuda()
-            target = target.cuda()
             output = model(images)
 
             output = torch.softmax(output,dim=1)
-            output = output.data.cpu().numpy()
-            output = np.argmax(output, axis=1)
+            pred = output.argmax(1)
 
-            prediction_box += list(output)
-            target_box += list(target.data.cpu().numpy())
+            meter.update(target.numpy(), pred.cpu().numpy(), output.cpu().numpy() if soft_auc else None)
 
             # measure elapsed time
             batch_time.update(time.time() - end)
             end = time.time()
 
+    auc, acc, precision, recall, f1score = meter.compute()
 
-    auc = roc_auc_score(target_box, prediction_box)
-    corrects = np.equal(np.array(target_box), np.array(prediction_box))
-    acc = float(sum(corrects)) / len(corrects)
-
-    #  mean class
-    precision = precision_score(target_box, prediction_box, average='macro')
-    recall = recall_score(target_box, prediction_box, average='macro')
-    f1score = f1_score(target_box, prediction_box, average='macro')
-
-    return losses.avg, round(auc, 4), round(acc, 4), round(precision, 4),  round(recall, 4),  round(f1score, 4)
+    return losses.avg, auc, acc, precision, recall, f1score
 
 
 def train(train_loader, model, criterion, optimizer):
@@ -1,10 +1,13 @@
 import torch
 import time
 import datasets
+from lib.seeding import worker_init
 from lib.utils import AverageMeter
 import torchvision.transforms as transforms
 import numpy as np
-from lib.utils import evaluation_metrics
+from lib.utils import evaluation_metrics, StreamingMetrics
+from lib.Prototype import ClassPrototype
+from lib.graph import knn_graph, label_propagation
 import random
 import os
 
@@ -19,11 +22,18 @@ torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
 os.environ['PYTHONHASHSEED'] = str(my_whole_seed)
 
-def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
-    net.eval()
-    net_time = AverageMeter()
+def extract_feature(args, net, inputs):
+    if args.multitask and args.domain:
+        features, features_rot = net(inputs)
+    elif args.multitask:
+        features, features_rot, features_whole = net(inputs)
+    else:
+        features = net(inputs)
+    return features
 
 
+def train_features(args, net, lemniscate, trainloader, testloader):
+    """Returns the train bank (D x N) and its labels on the gpu"""
     trainLabels = torch.LongTensor(trainloader.dataset.targets).cuda()
     trainnames = []
     if args.multiaug:
@@ -39,7 +49,7 @@ def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
                 trainloader.dataset.transform = testloader.dataset.transform
                 trainloader.dataset.train = False
                 num = 100
-            temploader = torch.utils.data.DataLoader(trainloader.dataset, batch_size=num, shuffle=False, num_workers=4, worker_init_fn=random.seed(111))
+            temploader = torch.utils.data.DataLoader(trainloader.dataset, batch_size=num, shuffle=False, num_workers=4, worker_init_fn=worker_init(111))
             for batch_idx, (inputs, _, targets, indexes) in enumerate(temploader):
                 if args.saveembed:
                     inputs = torch.cat(inputs, 0).cuda()
@@ -51,17 +61,8 @@ def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
                     # inputs = dataX.view([batch_size * types, channels, height, width])
                 batchSize = inputs.size(0)
 
-                if args.multitask and args.domain:
-                    features_inst, features_rot = net(inputs)
-                    trainFeatures[:,batch_idx * batchSize:batch_idx * batchSize + batchSize] = features_inst.data.t().cpu().numpy()
-                elif args.multitask:
-                    features_inst, features_rot, features = net(inputs)
-                    # print ("aaa", features_inst.shape, features_rot.shape, features.shape)
-                    # exit(0)
-                    trainFeatures[:,batch_idx * batchSize:batch_idx * batchSize + batchSize] = features_inst.data.t().cpu().numpy()
-                else:
-                    features = net(inputs)
-                    trainFeatures[:,batch_idx * batchSize:batch_idx * batchSize + batchSize] = features.data.t().cpu().numpy()
+                features_inst = extract_feature(args, net, inputs)
+                trainFeatures[:,batch_idx * batchSize:batch_idx * batchSize + batchSize] = features_inst.data.t().cpu().numpy()
 
                 trainnames += list(indexes)
         trainloader.dataset.transform = transform_bak
@@ -70,9 +71,18 @@ def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
     else:
         trainFeatures = lemniscate.memory.t()
 
+    return trainFeatures, trainLabels
 
-    pred_box = []
-    label_box = []
+
+def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C, save_pred=""):
+    net.eval()
+    net_time = AverageMeter()
+
+    trainFeatures, trainLabels = train_features(args, net, lemniscate, trainloader, testloader)
+
+    meter = StreamingMetrics(C)
+    # per-sample results are only kept when they are saved for the bootstrap
+    pred_box, label_box, score_box = [], [], []
 
     with torch.no_grad():
         retrieval_one_hot = torch.zeros(K, C).cuda()
@@ -81,12 +91,7 @@ def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
             end = time.time()
             targets = targets.cuda()
             batchSize = inputs.size(0)
-            if args.multitask and args.domain:
-                features, features_rot = net(inputs)
-            elif args.multitask:
-                features, features_rot, features_whole = net(inputs)
-            else:
-                features = net(inputs)
+            features = extract_feature(args, net, inputs)
             net_time.update(time.time() - end)
 
             dist = torch.mm(features, trainFeatures)
@@ -114,15 +119,70 @@ def kNN(args, net, lemniscate, trainloader, testloader, K, sigma, C):
             _, predictions = probs.sort(1, True)
 
             # get pred result
-            pred = predictions.narrow(1,0,1).cpu().numpy()
-            pred = [item[0] for item in pred]
+            pred = predictions.narrow(1,0,1).view(-1)
+            score = probs.div(probs.sum(1, keepdim=True)).cpu().numpy()
+            # hard-prediction AUC as in the paper; --soft-auc ranks by vote share
+            meter.update(targets.cpu().numpy(), pred.cpu().numpy(), score if getattr(args, "soft_auc", False) else None)
+
+            if save_pred:
+                pred_box.append(pred.cpu().numpy())
+                label_box.append(targets.cpu().numpy())
+                score_box.append(score)
+
+    auc, acc, precision, recall, f1score = meter.compute()
+
+    if save_pred:
+        # the reported AUC and how it was computed, for read_result.py --bootstrap
+        np.savez(save_pred, label=np.concatenate(label_box), pred=np.concatenate(pred_box), score=np.concatenate(score_box),
+                 auc=auc, soft=getattr(args, "soft_auc", False))
+
+    return auc, acc, precision, recall, f1score
+
+
+def prototype(args, net, lemniscate, trainloader, testloader, C, num_proto=1):
+    """Nearest class-prototype evaluation, a C*num_proto alternative to kNN"""
+    net.eval()
+
+    trainFeatures, trainLabels = train_features(args, net, lemniscate, trainloader, testloader)
+    classifier = ClassPrototype(trainFeatures.size(0), C, num_proto).cuda()
+    classifier.fit(trainFeatures.t(), trainLabels)
+
+    meter = StreamingMetrics(C)
 
-            # append to result box
-            pred_box += pred
-            target_numpy = list(targets.cpu().numpy())
-            label_box += target_numpy
+    with torch.no_grad():
+        for batch_idx, (inputs, targets, indexes, name) in enumerate(testloader):
+            features = extract_feature(args, net, inputs)
+            predictions = classifier(features).argmax(1)
+            meter.update(targets.numpy(), predictions.cpu().numpy())
 
-    auc, acc, precision, recall, f1score = evaluation_metrics(label_box, pred_box, C)
+    auc, acc, precision, recall, f1score = meter.compute()
 
     return auc, acc, precision, recall, f1score
 
+
+def labelprop(args, net, lemniscate, trainloader, testloader, K, C, alpha=0.99):
+    """Transductive evaluation: label propagation on a sparse top-K graph over
+    train + test embeddings. The AUC uses the propagated class scores."""
+    net.eval()
+
+    trainFeatures, trainLabels = train_features(args, net, lemniscate, trainloader, testloader)
+
+    test_box = []
+    label_box = []
+    with torch.no_grad():
+        for batch_idx, (inputs, targets, indexes, name) in enumerate(testloader):
+            test_box.append(extract_feature(args, net, inputs))
+            label_box += list(targets.numpy())
+
+        features = torch.cat([trainFeatures.t(), torch.cat(test_box, 0)], 0)
+        ntrain = trainFeatures.size(1)
+        labels = torch.cat([trainLabels, torch.zeros(len(label_box), dtype=torch.long, device=trainLabels.device)])
+        labeled = torch.arange(features.size(0), device=features.device) < ntrain
+
+        S = knn_graph(features, K)
+        score = label_propagation(S, labels, labeled, C, alpha=alpha)[ntrain:]
+        pred_box = list(score.argmax(1).cpu().numpy())
+
+    auc, acc, precision, recall, f1score = evaluation_metrics(label_box, pred_box, C, score=score.cpu().numpy())
+
+    return auc, acc, precision, recall, f1score
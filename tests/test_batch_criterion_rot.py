@@ -0,0 +1,73 @@
+import argparse
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from lib.BatchAverageRot import BatchCriterionRot
+
+
+def baseline_k4(x, T=0.1):
+    """The 4-rotation loss as it was written before --rot-k, negM = 1."""
+    batchSize = x.size(0)
+    diag_mat = 1 - torch.eye(batchSize, dtype=x.dtype)
+    losses = 0
+    for i in range(0, 4):
+        reordered_x = torch.cat((x.narrow(0, batchSize // 2, batchSize // 2), x.narrow(0, 0, batchSize // 2)), 0)
+        if i > 0:
+            idx = np.arange(i, int(batchSize), 4)
+            offsets = {1: [0, 1, 2, -1], 2: [0, 1, -2, -1], 3: [0, -3, -2, -1]}[i]
+            index = np.stack([idx + o for o in offsets])
+            reordered_x = reordered_x[list(index.flatten("F")), :]
+        pos = (x * reordered_x).sum(1).div(T).exp()
+        all_prob = torch.mm(x, x.t()).div(T).exp() * diag_mat
+        all_div = all_prob.sum(1)
+        lnPmt = torch.div(pos, all_div)
+        lnPon = -torch.div(all_prob, all_div.repeat(batchSize, 1).t()).add(-1)
+        lnPon = lnPon.log().sum(1) - (-lnPmt.add(-1)).log()
+        losses += -(lnPmt.log().sum(0) + lnPon.sum(0)) / batchSize
+    return losses / 4.0
+
+
+def naive(x, k, T=0.1):
+    """Row r of one view is paired with the other view's row in the same
+    group whose rotation slot is i places further, for i < k."""
+    n = x.size(0)
+    half = n // 2
+    losses = 0
+    for i in range(k):
+        partner = [((r + half) % n) // k * k + (r % k + i) % k for r in range(n)]
+        pos = (x * x[partner]).sum(1).div(T).exp()
+        all_prob = torch.mm(x, x.t()).div(T).exp() * (1 - torch.eye(n, dtype=x.dtype))
+        all_div = all_prob.sum(1)
+        p = pos / all_div
+        neg = torch.log(1 - all_prob / all_div[:, None]).sum(1) - torch.log(1 - p)
+        losses += -(torch.log(p).sum() + neg.sum()) / n
+    return losses / k
+
+
+def features(n):
+    torch.manual_seed(0)
+    return F.normalize(torch.randn(n, 16, dtype=torch.float64), dim=1)
+
+
+def criterion(k, batch_size=4):
+    return BatchCriterionRot(1, 0.1, batch_size, argparse.Namespace(multitask=True, rot_k=k))
+
+
+def test_k4_matches_baseline():
+    x = features(2 * 4 * 4)
+    assert torch.allclose(criterion(4)(x, None), baseline_k4(x))
+
+
+@pytest.mark.parametrize("k", [1, 2, 4])
+def test_rot_k_pairs(k):
+    x = features(2 * 4 * k)
+    assert torch.allclose(criterion(k)(x, None), naive(x, k))
+
+
+def test_last_batch_not_full():
+    # built for batch size 4, fed a final batch of 3 samples
+    x = features(2 * 3 * 4)
+    assert torch.allclose(criterion(4, batch_size=4)(x, None), baseline_k4(x))
@@ -0,0 +1,25 @@
+import numpy as np
+
+from lib.samplers import LocalitySampler
+
+
+def test_locality_sampler():
+    rng = np.random.RandomState(0)
+    inode = rng.permutation(1000) * 7 + 100
+    sampler = LocalitySampler(inode, chunk=100, seed=0)
+    rank = np.argsort(np.argsort(inode))
+
+    epochs = []
+    for epoch in range(2):
+        sampler.set_epoch(epoch)
+        order = [int(i) for i in sampler]
+        assert sorted(order) == list(range(1000))
+        # every run of 100 draws covers one block of 100 inode neighbours
+        for start in range(0, 1000, 100):
+            chunk = rank[order[start:start + 100]]
+            assert chunk.max() - chunk.min() == 99
+        epochs.append(order)
+    assert epochs[0] != epochs[1]
+
+    sampler.set_epoch(0)
+    assert [int(i) for i in sampler] == epochs[0]
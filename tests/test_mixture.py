@@ -0,0 +1,62 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms as transforms
+from torch.utils.data.dataloader import default_collate
+
+from datasets.mixture import mixture
+
+
+def fake_root(root):
+    """A 10-image AMD Training400 and a 6-image Kaggle DR train list."""
+    rng = np.random.RandomState(0)
+    amd = os.path.join(root, "Training400", "resized_image_320")
+    dr = os.path.join(root, "kaggle_dr", "train")
+    os.makedirs(amd)
+    os.makedirs(dr)
+    names = ["A%04d.jpg" % i if i % 2 else "N%04d.jpg" % i for i in range(10)]
+    for name in names:
+        cv2.imwrite(os.path.join(amd, name), rng.randint(0, 255, (40, 40, 3), np.uint8))
+    with open(os.path.join(root, "Training400", "random_list.txt"), "w") as f:
+        f.write("\n".join(names) + "\n")
+    dr_names = ["train/%d_left.jpeg" % i for i in range(6)]
+    for name in dr_names:
+        cv2.imwrite(os.path.join(root, "kaggle_dr", name), rng.randint(0, 255, (60, 50, 3), np.uint8))
+    with open(os.path.join(root, "kaggle_dr", "data_list.txt"), "w") as f:
+        f.write("\n".join(dr_names) + "\n")
+
+
+def make_args(root, **kwargs):
+    args = argparse.Namespace(data=str(root), seed=0, domain=False, multitask=False, multiaug=True, synthesis=False,
+                              aug_backend="pil", image_cache_mb=0)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+@pytest.mark.parametrize("multitask", [False, True])
+def test_collate_amd_and_dr(tmp_path, multitask):
+    fake_root(str(tmp_path))
+    transform = transforms.Compose([transforms.Resize((16, 16)), transforms.ToTensor()])
+    mixed, weights = mixture("amd:1,dr:1", transform, make_args(tmp_path, multitask=multitask))
+    amd, dr = mixed.sizes
+    assert weights == [1., 1.] and dr == 6
+
+    batch = default_collate([mixed[0], mixed[amd], mixed[1], mixed[amd + 1]])
+    views, target, index, name = batch
+    assert len(views) == 2 and views[0].shape == (4, 3, 16, 16)
+    assert index.tolist() == [0, amd, 1, amd + 1]
+    assert name[0].startswith("amd/") and name[1].startswith("dr/")
+    if multitask:
+        assert len(target) == 2 and target[0].shape == (4,) and target[1].tolist() == [0, 0, 0, 0]
+    else:
+        assert torch.is_tensor(target) and target.shape == (4,)
+
+
+def test_synthesis_refused(tmp_path):
+    with pytest.raises(ValueError):
+        mixture("amd:1,dr:1", None, make_args(tmp_path, synthesis=True))
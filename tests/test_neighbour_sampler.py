@@ -0,0 +1,64 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from lib.samplers import NeighbourBatchSampler
+
+
+def memory_bank(n=64, groups=4, dim=8):
+    """n rows around `groups` orthogonal directions."""
+    torch.manual_seed(0)
+    centres = torch.eye(dim)[:groups]
+    return F.normalize(centres[torch.arange(n) % groups] + 0.05 * torch.randn(n, dim), dim=1)
+
+
+def sampler(every=1, memory=True):
+    s = NeighbourBatchSampler(64, 8, hard=0.5, clusters=4, every=every, seed=0)
+    if memory:
+        s.memory = memory_bank()
+    return s
+
+
+def epoch(s, e):
+    s.set_epoch(e)
+    return list(s)
+
+
+def test_batch_composition():
+    s = sampler()
+    for e in range(3):
+        batches = epoch(s, e)
+        flat = [int(i) for batch in batches for i in batch]
+        assert len(batches) == len(s) == 8
+        assert all(len(batch) == 8 for batch in batches)
+        assert len(set(flat)) == len(flat) == 64
+        assert all(i.epoch == e for batch in batches for i in batch)
+        if e > 0:
+            # the first hard indices of every batch share a cluster
+            for batch in batches:
+                assert len(set(s.assign[[int(i) for i in batch[:s.hard]]].tolist())) == 1
+
+
+def test_recluster_every(monkeypatch):
+    s = sampler(every=2)
+    calls = []
+    recluster = s.recluster
+    monkeypatch.setattr(s, "recluster", lambda generator: calls.append(s.epoch) or recluster(generator))
+    for e in range(6):
+        epoch(s, e)
+    # none before the bank is trained, first use, then every 2 epochs
+    assert calls == [1, 2, 4]
+
+
+def test_recluster_follows_the_memory():
+    s = sampler()
+    epoch(s, 1)
+    first = s.assign.clone()
+    s.memory = s.memory[torch.randperm(64, generator=torch.Generator().manual_seed(1))]
+    epoch(s, 2)
+    assert not torch.equal(first, s.assign)
+
+
+def test_without_memory_bank():
+    with pytest.raises(RuntimeError):
+        epoch(sampler(memory=False), 0)
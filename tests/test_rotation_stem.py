@@ -0,0 +1,39 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from lib.prefetch import rotate
+from models.resnet import rotation_stem, verify_rotation_stem
+
+
+def rotated_conv1(conv1, x):
+    n = x.size(0)
+    return conv1(torch.stack([rotate(x, r) for r in range(4)], dim=1).view((n * 4,) + x.shape[1:]))
+
+
+@pytest.mark.parametrize("size", [224, 32, 31, 17])
+def test_rotation_stem_is_exact(size):
+    torch.manual_seed(0)
+    conv1 = nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3, bias=False).double()
+    x = torch.randn(2, 3, size, size, dtype=torch.float64)
+    with torch.no_grad():
+        assert (rotation_stem(x, conv1.weight) - rotated_conv1(conv1, x)).abs().max().item() < 1e-10
+
+
+@pytest.mark.parametrize("size", [224, 223])
+def test_verify_rotation_stem(size):
+    conv1 = nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3, bias=False)
+    assert verify_rotation_stem(conv1, size=size) < 1e-4
+
+
+def test_rotation_stem_rejects_non_square():
+    conv1 = nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3, bias=False)
+    with pytest.raises(ValueError):
+        rotation_stem(torch.randn(1, 3, 32, 30), conv1.weight)
+    with pytest.raises(ValueError):
+        rotation_stem(torch.randn(3, 32, 32), conv1.weight)
+
+
+def test_rotation_stem_rejects_other_conv1():
+    with pytest.raises(ValueError):
+        verify_rotation_stem(nn.Conv2d(3, 64, kernel_size=3, stride=1, padding=1, bias=False))